@@ -1,4 +1,5 @@
 import streamlit as st
+from functions.config import get_flag
 
 #streamlit config
 st.set_page_config(
@@ -12,8 +13,19 @@ st.title("🎯🔫 Minh's Shooting Progress Tracker 🎯🔫")
 #import pages
 dashboard_page = st.Page("dashboard.py", title="Dashboard", icon="📊")
 logging_page = st.Page("logging.py", title="Logging", icon="📝")
+pages = [dashboard_page, logging_page]
 
+# Timing panel for finding slow pages and queries, off unless INSTRUMENTATION_PANEL is set
+if get_flag("INSTRUMENTATION_PANEL"):
+    pages.append(st.Page("instrumentation.py", title="Instrumentation", icon="⏱️"))
 
-pg = st.navigation([dashboard_page, logging_page])
+# Optionally fill the connection pool and shared caches in the background on the first page view,
+# off unless PREWARM is set
+if get_flag("PREWARM"):
+    from functions.prewarm import start_prewarm
+    start_prewarm()
+
+# Pages are files, st.navigation only runs the selected one
+pg = st.navigation(pages)
 pg.run()
 
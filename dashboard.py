@@ -1,20 +1,65 @@
+import io
+import time
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import altair as alt
-import datetime
-from functions.db import fetch_all_data
-from functions.dash import display_metric
+from functions.db import (
+    fetch_all_data,
+    fetch_metrics,
+    fetch_most_recent_gun,
+)
+from functions.dash import display_metric, metric_slot, aggregate_frame, cached_figure, display_paged_table, prefetch_page, trend_frame, trend_breakdown_frame, TREND_WINDOWS
+from functions.instrument import record, timed
+from functions.loader import submit, iter_completed
 
-alt.themes.enable("dark")
+page_started = time.perf_counter()
 
-# Fetch all data from the database
-df = pd.DataFrame(fetch_all_data())
+# Optional date range, all metrics and charts are aggregated in the database
+date_range = st.date_input("Date Range", value=(), help="Leave empty to include every session")
+start_date = date_range[0] if len(date_range) > 0 else None
+end_date = date_range[1] if len(date_range) > 1 else None
 
-#create tabs
-tab1, tab2, tab3 = st.tabs(["Main Metrics","Ammo Details", "Gun Details"])
+# Only the selected view is queried and drawn, unlike st.tabs which runs every tab on each rerun
+VIEWS = ["Main Metrics", "Ammo Details", "Gun Details", "Trends"]
+view = st.radio("View", VIEWS, key="dashboard_view", horizontal=True, label_visibility="collapsed")
 
-with tab1:
+# Every query the view needs runs at once, each on its own pooled connection,
+# and each part of the view is drawn as soon as its result arrives
+session_filters = dict(start_date=start_date, end_date=end_date)
+if view == "Main Metrics":
+    session_data = prefetch_page("session_data", fetch_all_data, session_filters)
+    loads = {
+        "popular_gun": submit(aggregate_frame, "gun_name", "detail_count", start_date, end_date, limit=1),
+        "session_data": session_data[2],
+    }
+elif view == "Trends":
+    # Trends are read from the day/week/month rollup tables, not from the session history
+    period = st.radio("Period", ["day", "week", "month"], index=1, key="trend_period", horizontal=True, format_func=str.capitalize)
+    loads = {
+        "trend": submit(trend_frame, period, start_date, end_date),
+        "gun_trend": submit(trend_breakdown_frame, period, "gun", "rounds_fired", start_date, end_date),
+        "caliber_trend": submit(trend_breakdown_frame, period, "caliber", "rounds_fired", start_date, end_date),
+    }
+elif view == "Ammo Details":
+    loads = {
+        "ammo_types": submit(aggregate_frame, "ammo_type", "rounds_fired", start_date, end_date),
+        "ammo_manufacturers": submit(aggregate_frame, "ammo_manufacturer", "rounds_fired", start_date, end_date),
+    }
+else:
+    loads = {
+        "popular_gun": submit(aggregate_frame, "gun_name", "detail_count", start_date, end_date, limit=1),
+        "gun_rounds": submit(aggregate_frame, "gun_name", "rounds_fired", start_date, end_date),
+        "most_recent_gun": submit(fetch_most_recent_gun, start_date, end_date),
+        "top_avg_rounds_gun": submit(aggregate_frame, "gun_name", "avg_rounds_fired", start_date, end_date, limit=1),
+        "gun_manufacturers": submit(aggregate_frame, "gun_manufacturer", "rounds_fired", start_date, end_date),
+    }
+
+with timed("dashboard/totals"):
+    totals = {key: float(value) for key, value in fetch_metrics(start_date, end_date).items()}
+if not totals['detail_count']:
+    st.info("No sessions logged yet." if start_date is None else "No sessions logged in this date range.")
+    st.stop()
+
+if view == "Main Metrics":
     # Display metrics in Streamlit
     st.title("Gun Range Statistics")
 
@@ -23,38 +68,45 @@ with tab1:
 
     with col1:
         # Total time spent at the range
-        total_time = df.drop_duplicates(subset='date')['duration_minutes'].sum()
+        total_time = int(totals['session_minutes'])
         display_metric(col1, "Total Time Spent at Range", f"{total_time} mins")
 
         # Total number of shots fired
-        total_shots = df['rounds_fired'].sum()
+        total_shots = int(totals['rounds_fired'])
         display_metric(col1, "Total Shots Fired", total_shots)
 
     with col2:
         # Most popular gun name
-        popular_gun = df['gun_name'].value_counts().idxmax()
-        display_metric(col2, "Most Popular Gun", popular_gun)
+        show_popular_gun = metric_slot(col2, "Most Popular Gun")
 
         # Average session duration
-        avg_duration = round(df['duration_minutes'].mean())
+        avg_duration = round(totals['detail_minutes'] / totals['detail_count'])
         display_metric(col2, "Average Session Duration", f"{avg_duration} mins")
 
     with col3:
         # Average rounds fired per session
-        avg_rounds_fired = round(df['rounds_fired'].mean(), 1)
+        avg_rounds_fired = round(totals['rounds_fired'] / totals['detail_count'], 1)
         display_metric(col3, "Average Rounds Fired per Session", avg_rounds_fired)
 
         # Total cost of ammo
-        total_ammo_cost = df['ammo_cost_total'].sum()
+        total_ammo_cost = totals['ammo_cost_total']
         formatted_total_ammo_cost = "${:,.2f}".format(total_ammo_cost)
         display_metric(col3, "Total Ammo Cost", formatted_total_ammo_cost)
 
     # Session raw data ordered by date descending
     st.title("Session Data")
-    df_sorted = df.sort_values(by='date', ascending=False)
-    st.write(df_sorted)
+    session_data_slot = st.container()
 
-with tab2:
+    # The export is read from the local snapshot, only sessions added since it was last refreshed are fetched
+    if st.button("Prepare CSV Export"):
+        # Imported on first use, most page views never export
+        from functions.snapshot import export_snapshot_csv
+        export = io.StringIO()
+        with timed("dashboard/csv export"):
+            export_snapshot_csv(export, start_date=start_date, end_date=end_date)
+        st.download_button("Download CSV", export.getvalue(), file_name="shooting_sessions.csv", mime="text/csv")
+
+elif view == "Ammo Details":
     # Metrics for ammo details
     st.title("Ammo Details")
 
@@ -63,50 +115,47 @@ with tab2:
 
     with col1:
         # Number of unique ammos
-        unique_ammo_count = df['ammo_type'].nunique()
-        display_metric(col1, "Unique Ammo Types", unique_ammo_count)
+        show_unique_ammo_count = metric_slot(col1, "Unique Ammo Types")
 
     with col2:
         # Total rounds fired
-        total_rounds_fired = df['rounds_fired'].sum()
+        total_rounds_fired = int(totals['rounds_fired'])
         display_metric(col2, "Total Rounds Fired", total_rounds_fired)
 
     with col3:
         # Average rounds fired per session
-        avg_rounds_fired = df['rounds_fired'].mean()
+        avg_rounds_fired = totals['rounds_fired'] / totals['detail_count']
         display_metric(col3, "Avg Rounds/Session", round(avg_rounds_fired, 1))
 
     with col4:
         # Average cost per round
-        avg_cost_per_round = df['ammo_cost_total'].sum() / df['rounds_fired'].sum()
+        avg_cost_per_round = totals['ammo_cost_total'] / totals['rounds_fired']
         display_metric(col4, "Avg Cost/Round", f"${avg_cost_per_round:.2f}")
 
     # Display ammo section stats in columns
     col5, col6 = st.columns([1,3])
-    
-    # Display pie chart for ammo type distribution
-    ammo_type_grouped = df.groupby('ammo_type')['rounds_fired'].sum().reset_index()
-    fig = px.pie(ammo_type_grouped, names='ammo_type', values='rounds_fired', title='Ammo Type Distribution',color_discrete_sequence=px.colors.sequential.Inferno)
-    with col5:
-        st.plotly_chart(fig, use_container_width=True)
+    ammo_type_chart = col5.empty()
+    ammo_manufacturer_chart = col6.empty()
 
-    # Display bar chart for ammo manufacturer distribution
-    ammo_manufacturer_grouped = df.groupby('ammo_manufacturer')['rounds_fired'].sum().reset_index()
-    ammo_manufacturer_grouped = ammo_manufacturer_grouped.sort_values(by='rounds_fired', ascending=False)
-    fig = px.bar(ammo_manufacturer_grouped, x='ammo_manufacturer', y='rounds_fired', title='Ammo Manufacturer Distribution', color_discrete_sequence=["#FF0000"])
-    fig.update_layout(
-        yaxis=dict(showticklabels=False, showgrid=False),
-        xaxis_title='Ammo Manufacturer',
-        yaxis_title='Total Rounds Fired'
-    )
-    fig.update_traces(
-        text=ammo_manufacturer_grouped['rounds_fired'],
-        textposition='outside'
-    )
-    with col6:
-        st.plotly_chart(fig, use_container_width=True)
+elif view == "Trends":
+    st.title("Trends")
+    trend_caption = st.empty()
+
+    # Latest period with sessions, compared to the one before it
+    col1, col2, col3, col4 = st.columns(4)
+    show_period_rounds = metric_slot(col1, "Rounds Fired")
+    show_period_cost = metric_slot(col2, "Ammo Cost")
+    show_period_cost_per_round = metric_slot(col3, "Cost/Round")
+    show_period_minutes = metric_slot(col4, "Time at Range")
 
-with tab3:
+    col5, col6 = st.columns(2)
+    rounds_trend_chart = col5.empty()
+    cost_trend_chart = col6.empty()
+    col7, col8 = st.columns(2)
+    gun_trend_chart = col7.empty()
+    caliber_trend_chart = col8.empty()
+
+else:
     # Display Gun section title
     st.title("Gun Details")
 
@@ -115,49 +164,163 @@ with tab3:
 
     with col1:
         # Number of unique guns
-        unique_gun_count = df['gun_name'].nunique()
-        display_metric(col1, "Unique Guns", unique_gun_count)
+        show_unique_gun_count = metric_slot(col1, "Unique Guns")
 
     with col2:
         # Most popular gun name
-        popular_gun = df['gun_name'].value_counts().idxmax()
-        display_metric(col2, "Most Popular Gun", popular_gun)
+        show_popular_gun = metric_slot(col2, "Most Popular Gun")
 
     with col3:
         # Most Recent Gun Used
-        most_recent_gun = df['gun_name'].iloc[-1]
-        display_metric(col3, "Most Recent Gun Used", most_recent_gun)
+        show_most_recent_gun = metric_slot(col3, "Most Recent Gun Used")
 
     with col4:
         # Gun with the highest average rounds per session
-        avg_rounds_per_gun = df.groupby('gun_name')['rounds_fired'].mean().idxmax()
-        display_metric(col4, "Highest Avg Rounds/Session Gun", avg_rounds_per_gun)
-    
+        show_top_avg_rounds_gun = metric_slot(col4, "Highest Avg Rounds/Session Gun")
+
     # Display gun section in columns
     col5, col6 = st.columns(2)
+    gun_ranking_chart = col5.empty()
+    gun_manufacturer_chart = col6.empty()
 
-    # Display gun rankings
-    df['rounds_fired'] = pd.to_numeric(df['rounds_fired'])
-    gun_ranking_grouped = df.groupby('gun_name').agg({'rounds_fired': 'sum'}).reset_index()
+# Figures are built by cached_figure once per data version and date range, an unchanged dataset
+# re-renders the cached figure instead of running plotly express again. plotly.express is imported
+# by the builders, so it is only loaded once a chart is drawn
+def gun_rankings_figure(gun_rounds):
+    import plotly.express as px
+
+    gun_ranking_grouped = gun_rounds
     gun_ranking_grouped = gun_ranking_grouped.rename(columns={'gun_name': 'Gun Name', 'rounds_fired': 'Total Rounds Fired'})
     gun_ranking_grouped = gun_ranking_grouped.sort_values(by='Total Rounds Fired', ascending=True)
 
-    with col5:
-        fig = px.bar(gun_ranking_grouped, x='Total Rounds Fired', y='Gun Name', orientation='h', title='Gun Rankings by Most Shots Fired', text='Total Rounds Fired', color='Total Rounds Fired', color_continuous_scale='Inferno')
-        fig.update_traces(texttemplate='%{text:.2s}', textposition='outside')
-        fig.update_layout(showlegend=False, xaxis=dict(showgrid=False, showticklabels=False))
-        fig.update(layout_coloraxis_showscale=False)
-        st.plotly_chart(fig, use_container_width=True)
+    fig = px.bar(gun_ranking_grouped, x='Total Rounds Fired', y='Gun Name', orientation='h', title='Gun Rankings by Most Shots Fired', text='Total Rounds Fired', color='Total Rounds Fired', color_continuous_scale='Inferno')
+    fig.update_traces(texttemplate='%{text:.2s}', textposition='outside')
+    fig.update_layout(showlegend=False, xaxis=dict(showgrid=False, showticklabels=False))
+    fig.update(layout_coloraxis_showscale=False)
+    return fig
 
-    # Display gun manufacturer distribution
-    df['gun_manufacturer'] = df['gun_manufacturer'].str.capitalize()
-    gun_manufacturer_grouped = df.groupby('gun_manufacturer')['rounds_fired'].sum().reset_index()
+def gun_manufacturers_figure(gun_manufacturer_grouped):
+    import plotly.express as px
+    gun_manufacturer_grouped = gun_manufacturer_grouped.copy()
+    gun_manufacturer_grouped['gun_manufacturer'] = gun_manufacturer_grouped['gun_manufacturer'].str.capitalize()
+    gun_manufacturer_grouped = gun_manufacturer_grouped.groupby('gun_manufacturer')['rounds_fired'].sum().reset_index()
     gun_manufacturer_grouped = gun_manufacturer_grouped.rename(columns={'gun_manufacturer': 'Gun Manufacturer', 'rounds_fired': 'Total Rounds Fired'})
     gun_manufacturer_grouped = gun_manufacturer_grouped.sort_values(by='Total Rounds Fired', ascending=True)
 
-    with col6:
-        fig3 = px.bar(gun_manufacturer_grouped, x='Total Rounds Fired', y='Gun Manufacturer', orientation='h', title='Gun Manufacturer Distribution', text='Total Rounds Fired', color='Total Rounds Fired', color_continuous_scale='Inferno')
-        fig3.update_traces(texttemplate='%{text:.2s}', textposition='outside')
-        fig3.update_layout(showlegend=False, xaxis=dict(showgrid=False, showticklabels=False))
-        fig3.update(layout_coloraxis_showscale=False)
-        st.plotly_chart(fig3, use_container_width=True)
\ No newline at end of file
+    fig3 = px.bar(gun_manufacturer_grouped, x='Total Rounds Fired', y='Gun Manufacturer', orientation='h', title='Gun Manufacturer Distribution', text='Total Rounds Fired', color='Total Rounds Fired', color_continuous_scale='Inferno')
+    fig3.update_traces(texttemplate='%{text:.2s}', textposition='outside')
+    fig3.update_layout(showlegend=False, xaxis=dict(showgrid=False, showticklabels=False))
+    fig3.update(layout_coloraxis_showscale=False)
+    return fig3
+
+def ammo_types_figure(ammo_type_grouped):
+    import plotly.express as px
+    return px.pie(ammo_type_grouped, names='ammo_type', values='rounds_fired', title='Ammo Type Distribution',color_discrete_sequence=px.colors.sequential.Inferno)
+
+def ammo_manufacturers_figure(ammo_manufacturer_grouped):
+    import plotly.express as px
+    fig = px.bar(ammo_manufacturer_grouped, x='ammo_manufacturer', y='rounds_fired', title='Ammo Manufacturer Distribution', color_discrete_sequence=["#FF0000"])
+    fig.update_layout(
+        yaxis=dict(showticklabels=False, showgrid=False),
+        xaxis_title='Ammo Manufacturer',
+        yaxis_title='Total Rounds Fired'
+    )
+    fig.update_traces(
+        text=ammo_manufacturer_grouped['rounds_fired'],
+        textposition='outside'
+    )
+    return fig
+
+def trend_figure(trend, measure, title, label):
+    # Per period values as bars with their rolling average as a line
+    import plotly.express as px
+    fig = px.bar(trend, x='period_start', y=measure, title=title, labels={'period_start': '', measure: label}, color_discrete_sequence=["#FF0000"])
+    fig.add_scatter(x=trend['period_start'], y=trend[f'{measure}_avg'], mode='lines', name='Rolling Average', line=dict(color='#FFA500'))
+    fig.update_layout(legend=dict(orientation='h', y=-0.2))
+    return fig
+
+def breakdown_figure(breakdown, title):
+    import plotly.express as px
+    fig = px.bar(breakdown, x='period_start', y='rounds_fired', color='label', title=title, labels={'period_start': '', 'rounds_fired': 'Rounds Fired', 'label': ''}, color_discrete_sequence=px.colors.sequential.Inferno)
+    fig.update_layout(legend=dict(orientation='h', y=-0.2))
+    return fig
+
+def period_delta(latest, measure, fmt):
+    previous = latest[f'{measure}_prev']
+    return None if pd.isna(previous) else fmt.format(latest[measure] - previous)
+
+def show_trend(trend):
+    if trend.empty:
+        trend_caption.info("No sessions logged in this date range.")
+        return
+    latest = trend.iloc[-1]
+    trend_caption.caption(
+        f"Latest {period} with sessions: {latest['period_start']:%Y-%m-%d}, compared to the {period} with sessions before it. "
+        f"Lines show the average of the last {TREND_WINDOWS[period]} {period}s with sessions."
+    )
+    show_period_rounds(int(latest['rounds_fired']), period_delta(latest, 'rounds_fired', "{:+,.0f}"))
+    show_period_cost(f"${latest['ammo_cost_total']:,.2f}", period_delta(latest, 'ammo_cost_total', "{:+,.2f}"))
+    show_period_cost_per_round(f"${latest['cost_per_round']:.2f}", period_delta(latest, 'cost_per_round', "{:+.2f}"))
+    show_period_minutes(f"{int(latest['session_minutes'])} mins", period_delta(latest, 'session_minutes', "{:+,.0f}"))
+
+    name = period.capitalize()
+    fig = cached_figure(f"rounds_trend_{period}", lambda frame: trend_figure(frame, 'rounds_fired', f'Rounds Fired per {name}', 'Rounds Fired'), trend, start_date, end_date)
+    rounds_trend_chart.plotly_chart(fig, use_container_width=True)
+    fig = cached_figure(f"cost_trend_{period}", lambda frame: trend_figure(frame, 'cost_per_round', f'Cost per Round by {name}', 'Cost/Round'), trend, start_date, end_date)
+    cost_trend_chart.plotly_chart(fig, use_container_width=True)
+
+def show_gun_trend(breakdown):
+    fig = cached_figure(f"gun_trend_{period}", lambda frame: breakdown_figure(frame, f'Rounds Fired per {period.capitalize()} by Gun'), breakdown, start_date, end_date)
+    gun_trend_chart.plotly_chart(fig, use_container_width=True)
+
+def show_caliber_trend(breakdown):
+    fig = cached_figure(f"caliber_trend_{period}", lambda frame: breakdown_figure(frame, f'Rounds Fired per {period.capitalize()} by Caliber'), breakdown, start_date, end_date)
+    caliber_trend_chart.plotly_chart(fig, use_container_width=True)
+
+def show_gun_rankings(gun_rounds):
+    show_unique_gun_count(len(gun_rounds))
+
+    # Display gun rankings
+    fig = cached_figure("gun_rankings", gun_rankings_figure, gun_rounds, start_date, end_date)
+    gun_ranking_chart.plotly_chart(fig, use_container_width=True)
+
+def show_gun_manufacturers(gun_manufacturer_grouped):
+    # Display gun manufacturer distribution
+    fig3 = cached_figure("gun_manufacturers", gun_manufacturers_figure, gun_manufacturer_grouped, start_date, end_date)
+    gun_manufacturer_chart.plotly_chart(fig3, use_container_width=True)
+
+def show_ammo_types(ammo_type_grouped):
+    show_unique_ammo_count(len(ammo_type_grouped))
+
+    # Display pie chart for ammo type distribution
+    fig = cached_figure("ammo_types", ammo_types_figure, ammo_type_grouped, start_date, end_date)
+    ammo_type_chart.plotly_chart(fig, use_container_width=True)
+
+def show_ammo_manufacturers(ammo_manufacturer_grouped):
+    # Display bar chart for ammo manufacturer distribution
+    fig = cached_figure("ammo_manufacturers", ammo_manufacturers_figure, ammo_manufacturer_grouped, start_date, end_date)
+    ammo_manufacturer_chart.plotly_chart(fig, use_container_width=True)
+
+def show_session_data(rows):
+    # Uses the prefetched page, display_paged_table only queries again if the page changed
+    with session_data_slot:
+        display_paged_table("session_data", fetch_all_data, session_filters, prefetched=session_data)
+
+renderers = {
+    "popular_gun": lambda popular_gun: show_popular_gun(popular_gun['gun_name'].iloc[0]),
+    "gun_rounds": show_gun_rankings,
+    "most_recent_gun": lambda most_recent_gun: show_most_recent_gun(most_recent_gun),
+    "top_avg_rounds_gun": lambda top_gun: show_top_avg_rounds_gun(top_gun['gun_name'].iloc[0]),
+    "gun_manufacturers": show_gun_manufacturers,
+    "ammo_types": show_ammo_types,
+    "ammo_manufacturers": show_ammo_manufacturers,
+    "session_data": show_session_data,
+    "trend": show_trend,
+    "gun_trend": show_gun_trend,
+    "caliber_trend": show_caliber_trend,
+}
+for name, result in iter_completed(loads):
+    with timed(f"dashboard/{name}"):
+        renderers[name](result)
+
+record("page", "dashboard", time.perf_counter() - page_started)
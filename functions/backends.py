@@ -0,0 +1,431 @@
+import datetime
+import decimal
+import queue
+import re
+import sqlite3
+import threading
+import time
+
+from mysql.connector import pooling
+
+from functions.config import get_setting
+
+# Storage backends behind functions/db.py. Both hand out connections with the mysql.connector API
+# subset the helpers use (cursor(dictionary=, buffered=), commit, rollback, close) and provide the
+# few statements whose syntax differs between MySQL and SQLite.
+
+class MySQLBackend:
+    """
+    MySQL server reached through a process-wide mysql.connector pool.
+    """
+    name = "mysql"
+    embedded = False
+
+    def __init__(self, host, user, password, database, pool_size=5, pool_timeout=10, max_idle=300, port=3306, pool_name="shooting_log"):
+        self.config = dict(host=host, port=port, user=user, password=password, database=database)
+        self.pool_name = pool_name
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.max_idle = max_idle
+        self._pool = None
+        self._lock = threading.Lock()
+        self._last_used = {}
+        self._stats = {
+            "checkouts": 0,
+            "exhausted": 0,
+            "timeouts": 0,
+            "recycled": 0,
+            "wait_seconds": 0.0,
+        }
+
+    @classmethod
+    def from_settings(cls, address=None, pool_name="shooting_log"):
+        """
+        The DB_* settings, with host[:port] replaced by address when given (e.g. a read replica).
+        """
+        host, _, port = (address or get_setting("DB_HOST") or "").partition(":")
+        return cls(
+            host=host,
+            port=int(port or get_setting("DB_PORT", 3306)),
+            pool_name=pool_name,
+            user=get_setting("DB_USERNAME"),
+            password=get_setting("DB_PASSWORD"),
+            database=get_setting("DB_NAME"),
+            pool_size=int(get_setting("DB_POOL_SIZE", 5)),
+            pool_timeout=float(get_setting("DB_POOL_TIMEOUT", 10)),
+            max_idle=float(get_setting("DB_POOL_MAX_IDLE", 300)),
+        )
+
+    def get_pool(self):
+        """
+        Return the connection pool, creating it on first use.
+        """
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = pooling.MySQLConnectionPool(
+                        pool_name=self.pool_name,
+                        pool_size=self.pool_size,
+                        pool_reset_session=True,
+                        buffered=True,
+                        **self.config
+                    )
+        return self._pool
+
+    def connect(self):
+        """
+        Check out a connection from the pool. The pool pings it before handing it out,
+        and connections idle for longer than max_idle seconds are recycled.
+        Waits up to pool_timeout seconds when the pool is exhausted.
+        Calling close() on the connection returns it to the pool.
+        """
+        pool = self.get_pool()
+        started = time.monotonic()
+        exhausted = False
+        while True:
+            try:
+                conn = pool.get_connection()
+                break
+            except pooling.PoolError:
+                if not exhausted:
+                    exhausted = True
+                    with self._lock:
+                        self._stats["exhausted"] += 1
+                if time.monotonic() - started >= self.pool_timeout:
+                    with self._lock:
+                        self._stats["timeouts"] += 1
+                    raise
+                time.sleep(0.05)
+
+        now = time.monotonic()
+        last_used = self._last_used.get(id(conn._cnx))
+        if last_used is not None and now - last_used > self.max_idle:
+            # Drop connections that sat idle long enough to be killed by the server or a proxy
+            conn.reconnect()
+            with self._lock:
+                self._stats["recycled"] += 1
+        self._last_used[id(conn._cnx)] = now
+
+        with self._lock:
+            self._stats["checkouts"] += 1
+            if exhausted:
+                self._stats["wait_seconds"] += now - started
+        return conn
+
+    def release(self, conn):
+        self._last_used[id(conn._cnx)] = time.monotonic()
+        conn.close()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        if self._pool is not None:
+            stats["size"] = self._pool.pool_size
+            stats["available"] = self._pool._cnx_queue.qsize()
+        return stats
+
+    def insert_or_get(self, cursor, table, id_column, values, key_columns):
+        """
+        Insert a row unless one with the same unique key exists, in one round trip.
+        Returns (id, created).
+        """
+        # LAST_INSERT_ID(id) makes lastrowid the existing id when the unique key already matches,
+        # and rowcount is 1 for a new row and 0 when the existing row was matched
+        query = f"""
+            INSERT INTO {table} ({", ".join(values)})
+            VALUES ({", ".join(["%s"] * len(values))})
+            ON DUPLICATE KEY UPDATE {id_column} = LAST_INSERT_ID({id_column})
+        """
+        cursor.execute(query, list(values.values()))
+        return cursor.lastrowid, cursor.rowcount == 1
+
+    def ignore_duplicates(self, id_column):
+        """
+        Suffix for an INSERT that silently skips rows violating a unique key.
+        """
+        return f"ON DUPLICATE KEY UPDATE {id_column} = {id_column}"
+
+    def add_on_duplicate(self, key_column, columns):
+        """
+        Suffix for an INSERT ... VALUES that adds the inserted values to the existing row when key_column matches.
+        """
+        # The row alias replaces VALUES(column), deprecated since MySQL 8.0.20 (the alias needs 8.0.19)
+        return "AS new ON DUPLICATE KEY UPDATE " + ", ".join(f"{column} = {column} + new.{column}" for column in columns)
+
+    def existing_tables(self, cursor):
+        cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = DATABASE()")
+        return {row[0].lower() for row in cursor.fetchall()}
+
+    def existing_indexes(self, cursor):
+        cursor.execute("SELECT DISTINCT index_name FROM information_schema.statistics WHERE table_schema = DATABASE()")
+        return {row[0].lower() for row in cursor.fetchall()}
+
+    def existing_foreign_keys(self, cursor):
+        """
+        {(table, column): (constraint name, ON DELETE rule)} of the foreign keys in the database.
+        """
+        cursor.execute("""
+            SELECT k.table_name, k.column_name, k.constraint_name, r.delete_rule
+            FROM information_schema.key_column_usage k
+            JOIN information_schema.referential_constraints r
+                ON r.constraint_schema = k.constraint_schema AND r.constraint_name = k.constraint_name
+            WHERE k.table_schema = DATABASE() AND k.referenced_table_name IS NOT NULL
+        """)
+        return {(table.lower(), column.lower()): (name, rule.upper()) for table, column, name, rule in cursor.fetchall()}
+
+    def explain(self, cursor, query, params=None):
+        """
+        The plan of a query as (table, access, full_scan) rows, full_scan when every row of a table or index is read.
+        Sorts the server has to do itself are listed as "(sort)" rows.
+        """
+        cursor.execute("EXPLAIN " + query, params)
+        columns = [column.lower() for column in cursor.column_names]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        # An index scan only stops early when a LIMIT can be applied in index order, i.e. its select is not sorted again
+        limited = _has_limit(query)
+        sorted_selects = {row["id"] for row in rows if "filesort" in (row["extra"] or "")}
+        plan = []
+        for row in rows:
+            table = row["table"] or ""
+            access = f"{row['type']} key={row['key']} rows={row['rows']}" + (f" ({row['extra']})" if row["extra"] else "")
+            # <derivedN>, <subqueryN> and <unionN,M> are intermediate results, not stored tables
+            stored = not table.startswith("<")
+            full_index = row["type"] == "index" and not (limited and row["id"] not in sorted_selects)
+            plan.append((table, access, stored and (row["type"] == "ALL" or full_index)))
+            if "filesort" in (row["extra"] or ""):
+                plan.append(("(sort)", f"filesort for {table}", True))
+        return plan
+
+def _has_limit(query):
+    return re.search(r"\bLIMIT\b", query, re.IGNORECASE) is not None
+
+def key_lookup_query(table, id_column, key_columns):
+    """
+    The SELECT of the id of the row matching a unique key, as insert_or_get runs it when the row exists.
+    """
+    return f"SELECT {id_column} FROM {table} WHERE " + " AND ".join(f"{column} = %s" for column in key_columns)
+
+def _sqlite_value(value):
+    # Store dates and times as ISO strings, which sort and compare the same way as the MySQL types
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        seconds = int(value.total_seconds())
+        return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if hasattr(value, "item"):
+        # numpy scalars
+        return value.item()
+    return value
+
+def _sqlite_query(query):
+    # mysql.connector "format" paramstyle to sqlite "qmark"
+    return re.sub(r"%[s%]", lambda match: "?" if match.group() == "%s" else "%", query)
+
+class _SQLiteCursor:
+    def __init__(self, cursor, dictionary):
+        self._cursor = cursor
+        self._dictionary = dictionary
+
+    def execute(self, query, params=None):
+        self._cursor.execute(_sqlite_query(query), [_sqlite_value(value) for value in params or ()])
+
+    def executemany(self, query, rows):
+        self._cursor.executemany(_sqlite_query(query), [[_sqlite_value(value) for value in row] for row in rows])
+
+    def _convert(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return dict(zip(self.column_names, row))
+
+    def fetchone(self):
+        return self._convert(self._cursor.fetchone())
+
+    def fetchmany(self, size=1):
+        return [self._convert(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._convert(row) for row in self._cursor.fetchall()]
+
+    @property
+    def column_names(self):
+        return tuple(column[0] for column in self._cursor.description or ())
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+class _SQLiteConnection:
+    unread_result = False
+
+    def __init__(self, backend, raw):
+        self._backend = backend
+        self._raw = raw
+
+    def cursor(self, dictionary=False, buffered=True):
+        return _SQLiteCursor(self._raw.cursor(), dictionary)
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def consume_results(self):
+        pass
+
+    def close(self):
+        self._backend.release(self)
+
+class SQLiteBackend:
+    """
+    Embedded SQLite database file, no server required.
+    """
+    name = "sqlite"
+    embedded = True
+
+    def __init__(self, path, timeout=10):
+        self.path = path
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._stats = {"checkouts": 0, "opened": 0}
+
+    @classmethod
+    def from_settings(cls, address=None, pool_name=None):
+        """
+        The DB_PATH database, or the file at address when given (e.g. a read replica).
+        """
+        return cls(address or get_setting("DB_PATH", "shooting_log.sqlite3"), timeout=float(get_setting("DB_POOL_TIMEOUT", 10)))
+
+    def connect(self):
+        """
+        Reuse an idle connection or open a new one. Calling close() on the connection returns it for reuse.
+        """
+        try:
+            raw = self._idle.get(block=False)
+        except queue.Empty:
+            raw = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+            # WAL lets readers run while a write is in progress
+            raw.execute("PRAGMA journal_mode = WAL")
+            raw.execute("PRAGMA foreign_keys = ON")
+            with self._lock:
+                self._stats["opened"] += 1
+        with self._lock:
+            self._stats["checkouts"] += 1
+        return _SQLiteConnection(self, raw)
+
+    def release(self, conn):
+        raw, conn._raw = conn._raw, None
+        if raw is None:
+            return
+        raw.rollback()
+        self._idle.put(raw)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["available"] = self._idle.qsize()
+        return stats
+
+    def insert_or_get(self, cursor, table, id_column, values, key_columns):
+        """
+        Insert a row unless one with the same unique key exists. Returns (id, created).
+        """
+        query = f"""
+            INSERT INTO {table} ({", ".join(values)})
+            VALUES ({", ".join(["%s"] * len(values))})
+            ON CONFLICT DO NOTHING
+        """
+        cursor.execute(query, list(values.values()))
+        if cursor.rowcount == 1:
+            return cursor.lastrowid, True
+        cursor.execute(key_lookup_query(table, id_column, key_columns), [values[column] for column in key_columns])
+        return cursor.fetchone()[0], False
+
+    def ignore_duplicates(self, id_column):
+        return "ON CONFLICT DO NOTHING"
+
+    def add_on_duplicate(self, key_column, columns):
+        return f"ON CONFLICT ({key_column}) DO UPDATE SET " + ", ".join(f"{column} = {column} + excluded.{column}" for column in columns)
+
+    def existing_tables(self, cursor):
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        return {row[0].lower() for row in cursor.fetchall()}
+
+    def existing_indexes(self, cursor):
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        return {row[0].lower() for row in cursor.fetchall()}
+
+    def existing_foreign_keys(self, cursor):
+        # SQLite foreign keys are unnamed
+        keys = {}
+        for table in self.existing_tables(cursor):
+            cursor.execute(f"PRAGMA foreign_key_list({table})")
+            for row in cursor.fetchall():
+                keys[(table, row[3].lower())] = (None, row[6].upper())
+        return keys
+
+    def explain(self, cursor, query, params=None):
+        cursor.execute("EXPLAIN QUERY PLAN " + query, params)
+        rows = cursor.fetchall()
+        # Rows sharing a parent belong to the same select; see MySQLBackend.explain for when an index scan is bounded
+        limited = _has_limit(query)
+        sorted_selects = {row[1] for row in rows if row[3].startswith("USE TEMP B-TREE FOR ORDER BY")}
+        plan, intermediate = [], set()
+        for row in rows:
+            detail = row[3]
+            words = detail.split()
+            # Subqueries in FROM are run as co-routines or materialized, then scanned by their alias
+            if words[0] in ("CO-ROUTINE", "MATERIALIZE"):
+                intermediate.add(words[1])
+            table = words[1] if words[0] in ("SCAN", "SEARCH") else ""
+            full_scan = False
+            if words[0] == "SCAN" and "INDEX" in detail:
+                full_scan = not (limited and row[1] not in sorted_selects)
+            elif words[0] == "SCAN":
+                full_scan = table not in intermediate and table != "CONSTANT"
+            elif detail.startswith("USE TEMP B-TREE FOR ORDER BY"):
+                table, full_scan = "(sort)", True
+            plan.append((table, detail, full_scan))
+        return plan
+
+BACKENDS = {
+    "mysql": MySQLBackend,
+    "sqlite": SQLiteBackend,
+}
+
+def _backend_class():
+    name = str(get_setting("DB_BACKEND", "mysql")).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown DB_BACKEND: {name} (expected one of {', '.join(BACKENDS)})")
+    return BACKENDS[name]
+
+def backend_from_settings():
+    """
+    Build the backend selected by the DB_BACKEND setting.
+    """
+    return _backend_class().from_settings()
+
+def replicas_from_settings():
+    """
+    Build a backend of the DB_BACKEND type for each read replica in DB_READ_REPLICAS,
+    a comma separated list of host[:port] addresses (or database files for sqlite).
+    """
+    addresses = get_setting("DB_READ_REPLICAS") or ""
+    if isinstance(addresses, str):
+        addresses = addresses.split(",")
+    addresses = [address.strip() for address in addresses if address.strip()]
+    return [_backend_class().from_settings(address, pool_name=f"shooting_log_replica{i}") for i, address in enumerate(addresses, 1)]
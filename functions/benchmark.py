@@ -0,0 +1,306 @@
+import argparse
+import datetime
+import io
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+if __name__ == "__main__":
+    # Allow `python functions/benchmark.py`; appended so the pages in the repo root don't shadow stdlib modules
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Silence the bare-mode warnings streamlit logs outside of `streamlit run`. Reading an option
+# parses the config first, which would otherwise reset the level on the first st.secrets access
+from streamlit import config as streamlit_config, logger as streamlit_logger
+streamlit_config.get_option("logger.level")
+streamlit_logger.set_log_level("error")
+
+from functions import db, snapshot
+from functions.backends import SQLiteBackend
+from functions.dash import aggregate_frame
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Synthetic data is generated relative to this date so runs are reproducible
+LAST_DATE = datetime.date(2024, 12, 31)
+DETAILS_PER_SESSION = 5
+
+MANUFACTURERS = ["glock", "sig sauer", "smith & wesson", "ruger", "beretta", "cz", "springfield", "colt"]
+AMMO_MANUFACTURERS = ["federal", "winchester", "hornady", "remington", "cci", "fiocchi", "pmc"]
+AMMO_TYPES = ["fmj", "jhp", "soft point", "match", "birdshot", "buckshot"]
+CALIBERS = ["9mm", ".45 acp", ".40 s&w", ".22lr", "5.56", ".308", "12 gauge", ".357 mag"]
+GUN_CATEGORIES = ["pistol", "rifle", "shotgun", "revolver"]
+
+# The aggregations the dashboard page runs, as (dimension, measure, limit)
+DASHBOARD_AGGREGATES = [
+    ("gun_name", "rounds_fired", None),
+    ("gun_name", "detail_count", 1),
+    ("gun_name", "avg_rounds_fired", 1),
+    ("ammo_type", "rounds_fired", None),
+    ("ammo_manufacturer", "rounds_fired", None),
+    ("gun_manufacturer", "rounds_fired", None),
+]
+
+# Views of the dashboard page, see VIEWS in dashboard.py
+DASHBOARD_VIEWS = ["Main Metrics", "Ammo Details", "Gun Details", "Trends"]
+
+def generate(backend, details, seed=0):
+    """
+    Fill an empty database with roughly `details` session_details rows spread over
+    details / DETAILS_PER_SESSION daily sessions, plus a proportional number of guns and ammo.
+    """
+    rng = random.Random(seed)
+    gun_count = min(200, max(5, details // 1000))
+    ammo_count = min(300, max(5, details // 500))
+    session_count = max(1, math.ceil(details / DETAILS_PER_SESSION))
+
+    guns = []
+    for gun_id in range(1, gun_count + 1):
+        manufacturer = rng.choice(MANUFACTURERS)
+        model = f"model {gun_id}"
+        guns.append((gun_id, f"{manufacturer} {model}", rng.choice(GUN_CATEGORIES), manufacturer, model, rng.choice(CALIBERS), "personal", ""))
+    ammo = []
+    for ammo_id in range(1, ammo_count + 1):
+        ammo.append((ammo_id, rng.choice(AMMO_MANUFACTURERS), f"{rng.choice(AMMO_TYPES)} {ammo_id}", rng.choice(CALIBERS), ""))
+    sessions = []
+    for session_id in range(1, session_count + 1):
+        date = LAST_DATE - datetime.timedelta(days=session_count - session_id)
+        sessions.append((session_id, date, datetime.time(rng.randrange(8, 20)), rng.choice(["steel", "paper"]), rng.randrange(30, 180)))
+    # Every session gets at least one detail row
+    session_details = []
+    for index in range(details):
+        session_id = index + 1 if index < session_count else rng.randrange(1, session_count + 1)
+        rounds_fired = rng.randrange(20, 300)
+        session_details.append((session_id, rng.randrange(1, gun_count + 1), rng.randrange(1, ammo_count + 1), rounds_fired, round(rounds_fired * rng.uniform(0.2, 0.8), 2)))
+
+    conn = backend.connect()
+    try:
+        cursor = conn.cursor()
+        cursor.executemany("""
+            INSERT INTO gun (gun_id, name, category, manufacturer, model, caliber, ownership_type, gun_notes)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """, guns)
+        cursor.executemany("INSERT INTO ammo (ammo_id, manufacturer, type, caliber, ammo_notes) VALUES (%s, %s, %s, %s, %s)", ammo)
+        cursor.executemany("INSERT INTO session (session_id, date, time, target_type, duration_minutes) VALUES (%s, %s, %s, %s, %s)", sessions)
+        cursor.executemany("""
+            INSERT INTO session_details (session_id, gun_id, ammo_id, rounds_fired, ammo_cost_total)
+            VALUES (%s, %s, %s, %s, %s)
+        """, session_details)
+        conn.commit()
+        db.rebuild_summary(conn, backend)
+    finally:
+        backend.release(conn)
+    return dict(guns=gun_count, ammo=ammo_count, sessions=session_count, details=details)
+
+def _percentile(samples, fraction):
+    # Nearest-rank percentile, fine for the small sample counts used here
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def measure(func, repeat=10, warmup=1):
+    """
+    Time func() repeat times after warmup calls, then once more under tracemalloc.
+    Returns p50/p95 latency in milliseconds and the peak traced Python memory in KiB.
+    """
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return dict(p50_ms=statistics.median(samples), p95_ms=_percentile(samples, 0.95), peak_kib=peak / 1024)
+
+def _uncached(func, *args, **kwargs):
+    # Every timed read pays for the query rather than hitting st.cache_data
+    def run():
+        db.invalidate_cache()
+        return func(*args, **kwargs)
+    return run
+
+def _concurrent(sessions, func, *args):
+    # As many sessions as given running the same read at once, like after a deploy or a cache expiry
+    def run():
+        barrier = threading.Barrier(sessions)
+        errors = []
+        def call():
+            barrier.wait()
+            try:
+                func(*args)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=call) for _ in range(sessions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+    return run
+
+def _render_dashboard(view):
+    # Imported here so the db benchmarks also run where streamlit.testing is unavailable
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(os.path.join(REPO_ROOT, "dashboard.py"), default_timeout=600)
+    app.session_state["dashboard_view"] = view
+    def run():
+        db.invalidate_cache()
+        app.run()
+        if app.exception:
+            raise RuntimeError(app.exception[0].message)
+    return run
+
+def benchmark_cases(snapshot_dir, render=True):
+    """
+    Return (name, callable) pairs timed by run_benchmarks, against a database filled by generate().
+    The snapshot cases keep their Parquet files in snapshot_dir.
+    """
+    year_start = LAST_DATE - datetime.timedelta(days=364)
+    cases = [
+        ("fetch_existing_guns", _uncached(db.fetch_existing_guns)),
+        ("fetch_existing_ammo", _uncached(db.fetch_existing_ammo)),
+        ("fetch_recent_sessions", _uncached(db.fetch_recent_sessions, limit=26)),
+        ("fetch_recent_sessions[gun]", _uncached(db.fetch_recent_sessions, gun_id=1, limit=26)),
+        ("fetch_all_data", _uncached(db.fetch_all_data, limit=26)),
+        ("fetch_metrics", _uncached(db.fetch_metrics)),
+        ("fetch_metrics[year]", _uncached(db.fetch_metrics, year_start, LAST_DATE)),
+        ("fetch_most_recent_gun", _uncached(db.fetch_most_recent_gun)),
+    ]
+    for dimension, measure_name, limit in DASHBOARD_AGGREGATES:
+        suffix = f"[{limit}]" if limit else ""
+        cases.append((f"aggregate:{dimension}/{measure_name}{suffix}", _uncached(aggregate_frame, dimension, measure_name, limit=limit)))
+        cases.append((f"aggregate:{dimension}/{measure_name}{suffix}[year]", _uncached(aggregate_frame, dimension, measure_name, year_start, LAST_DATE, limit)))
+    for period in db.ROLLUP_PERIODS:
+        cases.append((f"fetch_trend[{period}]", _uncached(db.fetch_trend, period)))
+    cases.append(("fetch_trend_breakdown[week/gun]", _uncached(db.fetch_trend_breakdown, "week", "gun", "rounds_fired")))
+    history = db._session_history_query(db.ALL_DATA_COLUMNS, year_start, LAST_DATE)
+    cases.append(("fetch_data[history year x16]", _concurrent(16, db.fetch_data, *history)))
+    cases.append(("export_all_data_csv", lambda: db.export_all_data_csv(io.StringIO())))
+    # The first (warmup) refresh builds the snapshot, the timed ones find nothing new
+    cases.append(("refresh_snapshot[unchanged]", lambda: snapshot.refresh_snapshot(snapshot_dir)))
+    cases.append(("read_snapshot", lambda: snapshot.read_snapshot(snapshot_dir)))
+
+    # Writes go to dates after the synthetic history; each delete removes one of the submitted sessions
+    submitted = iter(range(1, 10 ** 9))
+    def submit():
+        date = LAST_DATE + datetime.timedelta(days=next(submitted))
+        db.submit_session(date, datetime.time(12), "paper", 60, 1, 1, 100, 30.0)
+    gun = dict(category="pistol", manufacturer=MANUFACTURERS[0], model="model 1", caliber=CALIBERS[0], ownership_type="personal", gun_notes="")
+    ammo = dict(manufacturer=AMMO_MANUFACTURERS[0], ammo_type=f"{AMMO_TYPES[0]} 1", caliber=CALIBERS[0], ammo_notes="")
+    cases += [
+        ("insert_or_get_gun", lambda: db.insert_or_get_gun(**gun)),
+        ("insert_or_get_ammo", lambda: db.insert_or_get_ammo(**ammo)),
+        ("submit_session", submit),
+        ("delete_most_recent_session", db.delete_most_recent_session),
+    ]
+    if render:
+        for view in DASHBOARD_VIEWS:
+            cases.append((f"render:dashboard[{view}]", _render_dashboard(view)))
+    return cases
+
+def run_benchmarks(scale, repeat=10, warmup=1, seed=0, path=None, render=True, only=None):
+    """
+    Generate `scale` session_details rows into a fresh SQLite database and time every benchmark case.
+    Returns {"data": row counts, "cases": {name: measure() result}}.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        database = path or os.path.join(directory, "benchmark.sqlite3")
+        if os.path.exists(database):
+            os.remove(database)
+        backend = SQLiteBackend(database)
+        db.set_backend(backend)
+        data = generate(backend, scale, seed)
+        results = {}
+        for name, func in benchmark_cases(os.path.join(directory, "snapshot"), render):
+            if only and not any(pattern in name for pattern in only):
+                continue
+            results[name] = measure(func, repeat, warmup)
+        # Drop the pooled connections before the temporary directory goes away
+        while not backend._idle.empty():
+            backend._idle.get().close()
+    return dict(data=data, cases=results)
+
+def compare(results, baseline, threshold=0.2):
+    """
+    Compare p50 latencies with a baseline of the same shape.
+    Returns (scale, case, baseline ms, current ms, ratio) rows for the cases slower than 1 + threshold.
+    """
+    regressions = []
+    for scale, run in results.items():
+        previous = baseline.get(scale, {}).get("cases", {})
+        for name, current in run["cases"].items():
+            if name not in previous or not previous[name]["p50_ms"]:
+                continue
+            ratio = current["p50_ms"] / previous[name]["p50_ms"]
+            if ratio > 1 + threshold:
+                regressions.append((scale, name, previous[name]["p50_ms"], current["p50_ms"], ratio))
+    return regressions
+
+def format_results(results, baseline=None):
+    lines = []
+    for scale, run in results.items():
+        data = run["data"]
+        lines.append(f"\n{int(scale):,} session details ({data['sessions']:,} sessions, {data['guns']} guns, {data['ammo']} ammo)")
+        lines.append(f"{'case':<52} {'p50 ms':>10} {'p95 ms':>10} {'peak KiB':>10} {'vs base':>8}")
+        previous = (baseline or {}).get(scale, {}).get("cases", {})
+        for name, result in run["cases"].items():
+            change = ""
+            if previous.get(name, {}).get("p50_ms"):
+                change = f"{result['p50_ms'] / previous[name]['p50_ms'] - 1:+.0%}"
+            lines.append(f"{name:<52} {result['p50_ms']:>10.2f} {result['p95_ms']:>10.2f} {result['peak_kib']:>10.0f} {change:>8}")
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the db helpers and the dashboard against synthetic SQLite data.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1000, 10000], help="session_details row counts to generate, e.g. 1000 100000 1000000")
+    parser.add_argument("--repeat", type=int, default=10, help="timed runs per case")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs per case")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="+", help="run only the cases whose name contains one of these strings")
+    parser.add_argument("--no-render", action="store_true", help="skip the full dashboard render")
+    parser.add_argument("--db", help="keep the generated database at this path (single scale only)")
+    parser.add_argument("--save", help="write the results as JSON, e.g. to use as a baseline")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="p50 slowdown over the baseline reported as a regression")
+    args = parser.parse_args(argv)
+    if args.db and len(args.scales) > 1:
+        parser.error("--db needs a single --scales value")
+
+    results = {}
+    for scale in args.scales:
+        results[str(scale)] = run_benchmarks(scale, args.repeat, args.warmup, args.seed, args.db, not args.no_render, args.only)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    print(format_results(results, baseline))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(dict(created=datetime.datetime.now().isoformat(timespec="seconds"), repeat=args.repeat, results=results), f, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for scale, name, before, after, ratio in regressions:
+            print(f"Regression at {int(scale):,} rows: {name} p50 {before:.2f} ms -> {after:.2f} ms ({ratio - 1:+.0%})")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+import argparse
+import os
+import sys
+
+if __name__ == "__main__":
+    # Allow `python functions/bulk_import.py`; appended so the pages in the repo root don't shadow stdlib modules
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from functions.db import bulk_insert_sessions
+
+# One row per session detail, the same fields as the logging form
+REQUIRED_COLUMNS = [
+    "date", "target_type", "duration_minutes",
+    "gun_category", "gun_manufacturer", "gun_model", "gun_caliber",
+    "ammo_manufacturer", "ammo_type", "ammo_caliber",
+    "rounds_fired", "ammo_cost_total",
+]
+OPTIONAL_COLUMNS = {
+    "time": "08:00",
+    "ownership_type": "personal",
+    "gun_notes": "",
+    "ammo_notes": "",
+}
+# Columns stored lowercase, as the logging form does
+LOWERCASE_COLUMNS = ["target_type", "gun_category", "gun_caliber", "ownership_type", "ammo_caliber"]
+TARGET_TYPES = ["steel", "paper"]
+GUN_CATEGORIES = ["pistol", "rifle", "shotgun", "revolver"]
+OWNERSHIP_TYPES = ["personal", "rental"]
+
+def read_sessions(source, filename=None):
+    """
+    Read a CSV or Excel file (path or file-like object) into a DataFrame of strings.
+    """
+    name = filename or str(source)
+    if name.lower().endswith((".xlsx", ".xls")):
+        df = pd.read_excel(source, dtype=str).fillna("")
+    else:
+        df = pd.read_csv(source, dtype=str, keep_default_na=False)
+    df.columns = [column.strip().lower() for column in df.columns]
+    return df
+
+def validate_sessions(df):
+    """
+    Check and convert the rows of read_sessions().
+    Returns (rows, errors): the valid rows as dicts ready for bulk_insert_sessions and a list of
+    (line number, message) for every invalid row, counting the header as line 1.
+    """
+    missing = [column for column in REQUIRED_COLUMNS if column not in df.columns]
+    if missing:
+        return [], [(1, f"Missing columns: {', '.join(missing)}")]
+
+    df = df.copy()
+    for column, default in OPTIONAL_COLUMNS.items():
+        if column not in df.columns:
+            df[column] = default
+        df[column] = df[column].replace("", default)
+    for column in REQUIRED_COLUMNS + list(OPTIONAL_COLUMNS):
+        df[column] = df[column].astype(str).str.strip()
+    for column in LOWERCASE_COLUMNS:
+        df[column] = df[column].str.lower()
+
+    dates = pd.to_datetime(df["date"], errors="coerce")
+    times = pd.to_datetime(df["time"], format="mixed", errors="coerce")
+    durations = pd.to_numeric(df["duration_minutes"], errors="coerce")
+    rounds = pd.to_numeric(df["rounds_fired"], errors="coerce")
+    costs = pd.to_numeric(df["ammo_cost_total"], errors="coerce")
+
+    checks = [
+        (dates.isna(), "invalid date"),
+        (times.isna(), "invalid time"),
+        (~df["target_type"].isin(TARGET_TYPES), f"target_type must be one of {', '.join(TARGET_TYPES)}"),
+        (~df["gun_category"].isin(GUN_CATEGORIES), f"gun_category must be one of {', '.join(GUN_CATEGORIES)}"),
+        (~df["ownership_type"].isin(OWNERSHIP_TYPES), f"ownership_type must be one of {', '.join(OWNERSHIP_TYPES)}"),
+        ((durations.isna()) | (durations < 1) | (durations % 1 != 0), "duration_minutes must be a whole number of at least 1"),
+        ((rounds.isna()) | (rounds < 1) | (rounds % 1 != 0), "rounds_fired must be a whole number of at least 1"),
+        ((costs.isna()) | (costs < 0), "ammo_cost_total must be a number of at least 0"),
+    ]
+    for column in ["gun_manufacturer", "gun_model", "ammo_manufacturer", "ammo_type", "gun_caliber", "ammo_caliber"]:
+        checks.append((df[column] == "", f"{column} is required"))
+
+    errors = []
+    invalid = pd.Series(False, index=df.index)
+    for mask, message in checks:
+        invalid |= mask
+        errors.extend((int(position) + 2, message) for position in mask.to_numpy().nonzero()[0])
+    errors.sort()
+
+    df["date"] = dates.dt.date
+    df["time"] = times.dt.time
+    df["duration_minutes"] = durations
+    df["rounds_fired"] = rounds
+    df["ammo_cost_total"] = costs
+    rows = []
+    for row in df.loc[~invalid, REQUIRED_COLUMNS + list(OPTIONAL_COLUMNS)].to_dict("records"):
+        row["duration_minutes"] = int(row["duration_minutes"])
+        row["rounds_fired"] = int(row["rounds_fired"])
+        row["ammo_cost_total"] = float(row["ammo_cost_total"])
+        rows.append(row)
+    return rows, errors
+
+def import_sessions(source, filename=None, dry_run=False, batch_size=500):
+    """
+    Validate a CSV/Excel file of historical sessions and load it with bulk_insert_sessions.
+    Nothing is written when dry_run is set or when any row is invalid.
+    Returns a report dict with the row counts, the validation errors and what was (or would be) created.
+    """
+    df = read_sessions(source, filename)
+    rows, errors = validate_sessions(df)
+    report = dict(rows=len(df), valid_rows=len(rows), errors=errors, imported=False)
+    if not rows:
+        return report
+    report.update(bulk_insert_sessions(rows, dry_run=dry_run or bool(errors), batch_size=batch_size))
+    report["imported"] = not dry_run and not errors
+    return report
+
+def format_report(report):
+    lines = [
+        f"Rows read: {report['rows']}",
+        f"Valid rows: {report['valid_rows']}",
+    ]
+    if "details" in report:
+        verb = "Created" if report["imported"] else "Would create"
+        lines.append(f"{verb}: {report['new_guns']} guns, {report['new_ammo']} ammo, {report['new_sessions']} sessions, {report['details']} session details")
+    for line, message in report["errors"]:
+        lines.append(f"Line {line}: {message}")
+    if report["errors"]:
+        lines.append("Nothing was imported, fix the errors above and try again.")
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import historical shooting sessions from a CSV or Excel file.")
+    parser.add_argument("file", help="CSV or Excel file, one row per session detail")
+    parser.add_argument("--dry-run", action="store_true", help="validate and report without writing anything")
+    parser.add_argument("--batch-size", type=int, default=500, help="rows per executemany batch")
+    args = parser.parse_args(argv)
+
+    report = import_sessions(args.file, dry_run=args.dry_run, batch_size=args.batch_size)
+    print(format_report(report))
+    return 1 if report["errors"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
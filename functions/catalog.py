@@ -0,0 +1,69 @@
+import pandas as pd
+import streamlit as st
+
+from functions.config import get_setting
+from functions.db import data_version, fetch_existing_guns, fetch_existing_ammo
+from functions.loader import submit
+
+GUN_COLUMNS = ["gun_id", "name", "category", "manufacturer", "model", "caliber", "ownership_type", "gun_notes"]
+AMMO_COLUMNS = ["ammo_id", "manufacturer", "type", "caliber", "ammo_notes"]
+
+def _caliber_key(caliber):
+    return str(caliber or "").strip().casefold()
+
+def _records(rows, columns, id_column, sort_columns, label):
+    # Returns ({id: record}, {id: label}) ordered by sort_columns, labels built column-wise
+    df = pd.DataFrame(rows, columns=columns)
+    df = df.sort_values(by=sort_columns, kind="stable")
+    labels = label(df.fillna("").astype(str))
+    ids = df[id_column].astype(int).tolist()
+    return dict(zip(ids, df.to_dict("records"))), dict(zip(ids, labels.tolist()))
+
+class Catalog:
+    """
+    Guns and ammo keyed by id for the logging form, with display labels and ammo indexed by caliber.
+    Built once per data version and shared read-only between sessions, see get_catalog().
+    """
+
+    def __init__(self, guns, ammo):
+        self.guns, self.gun_labels = _records(
+            guns, GUN_COLUMNS, "gun_id", ["manufacturer", "name"],
+            lambda df: df["name"] + " - " + df["ownership_type"] + " (" + df["caliber"] + ")",
+        )
+        self.ammo, self.ammo_labels = _records(
+            ammo, AMMO_COLUMNS, "ammo_id", ["manufacturer", "type"],
+            lambda df: df["manufacturer"] + " - " + df["type"] + " (" + df["caliber"] + ")",
+        )
+        self.ammo_by_caliber = {}
+        for ammo_id, record in self.ammo.items():
+            self.ammo_by_caliber.setdefault(_caliber_key(record["caliber"]), []).append(ammo_id)
+
+    def gun_ids(self):
+        return list(self.guns)
+
+    def ammo_ids(self, caliber=None):
+        """
+        Ammo ids in display order, only those matching caliber when given.
+        """
+        if caliber is None:
+            return list(self.ammo)
+        return list(self.ammo_by_caliber.get(_caliber_key(caliber), []))
+
+    def gun_label(self, gun_id):
+        return self.gun_labels[gun_id]
+
+    def ammo_label(self, ammo_id):
+        return self.ammo_labels[ammo_id]
+
+# st.cache_resource hands every session the same object instead of a copy per rerun;
+# keying on data_version() rebuilds it after any write from the app
+@st.cache_resource(ttl=float(get_setting("DB_CACHE_TTL", 600)), max_entries=1, show_spinner=False)
+def _load_catalog(version):
+    guns, ammo = submit(fetch_existing_guns), submit(fetch_existing_ammo)
+    return Catalog(guns.result(), ammo.result())
+
+def get_catalog():
+    """
+    Return the shared Catalog of existing guns and ammo.
+    """
+    return _load_catalog(data_version())
@@ -0,0 +1,23 @@
+import os
+import streamlit as st
+
+def get_setting(name, default=None):
+    """
+    Read a setting from st.secrets, falling back to the environment and then to default.
+    """
+    try:
+        if name in st.secrets:
+            return st.secrets[name]
+    except FileNotFoundError:
+        # No secrets.toml (e.g. running a script outside of streamlit)
+        pass
+    return os.environ.get(name, default)
+
+def get_flag(name, default=False):
+    """
+    Read an on/off setting, accepting TOML booleans as well as "true"/"1"/"yes" strings from the environment.
+    """
+    value = get_setting(name, default)
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
@@ -1,7 +1,109 @@
+import hashlib
+
 import streamlit as st
+import pandas as pd
+from functions.config import get_setting
+from functions.db import aggregate, data_version, fetch_trend, fetch_trend_breakdown, page_key
+from functions.loader import submit
 
 #define display metric function
 def display_metric(column, title, value, delta=None, emoji=""):
     with column:
         st.subheader(f"{title} {emoji}")
-        st.metric(label=title, value=value, delta=delta, label_visibility='hidden', border=True)
\ No newline at end of file
+        st.metric(label=title, value=value, delta=delta, label_visibility='hidden', border=True)
+
+#reserve a metric's place on the page with a placeholder value, returns a function that shows the real value
+def metric_slot(column, title, emoji=""):
+    slot = column.empty()
+    display_metric(slot.container(), title, "…", emoji=emoji)
+    return lambda value, delta=None: display_metric(slot.container(), title, value, delta, emoji)
+
+#content hash of a chart's frame; the frames are small aggregates, hashing them costs far less than building a figure
+def _frame_hash(frame):
+    digest = hashlib.sha1(repr(list(frame.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(frame, index=False).values.tobytes())
+    return digest.hexdigest()
+
+#build a chart figure once per name, date range and frame content; the figure object is shared between sessions and reruns.
+#keyed on the content rather than data_version(), which misses writes from other processes and query cache expiries
+@st.cache_resource(ttl=float(get_setting("DB_CACHE_TTL", 600)), max_entries=int(get_setting("DB_CACHE_MAX_ENTRIES", 64)), show_spinner=False)
+def _cached_figure(name, frame_hash, start_date, end_date, _build, _frame):
+    return _build(_frame)
+
+#build(frame) must be a pure function of frame, name identifies it in the cache
+def cached_figure(name, build, frame, start_date=None, end_date=None):
+    return _cached_figure(name, _frame_hash(frame), start_date, end_date, build, frame)
+
+#aggregate in the database and return the small result as a numeric DataFrame
+def aggregate_frame(dimension, measure, start_date=None, end_date=None, limit=None):
+    df = pd.DataFrame(aggregate(dimension, measure, start_date, end_date, limit), columns=[dimension, measure])
+    df[measure] = pd.to_numeric(df[measure], downcast="integer")
+    return df
+
+#periods of the rolling averages, per trend period
+TREND_WINDOWS = {"day": 7, "week": 4, "month": 3}
+
+#rollup trend as a numeric DataFrame, one row per period with sessions, see fetch_trend for the columns
+def trend_frame(period, start_date=None, end_date=None):
+    df = pd.DataFrame(fetch_trend(period, start_date, end_date, TREND_WINDOWS[period]))
+    if df.empty:
+        return pd.DataFrame(columns=["period_start"])
+    measures = df.columns.drop("period_start")
+    df[measures] = df[measures].apply(pd.to_numeric)
+    df["period_start"] = pd.to_datetime(df["period_start"])
+    return df
+
+#an additive measure per period split by gun or caliber, labels outside the top ones by total are summed as "Other"
+def trend_breakdown_frame(period, dimension, measure, start_date=None, end_date=None, top=5):
+    df = pd.DataFrame(fetch_trend_breakdown(period, dimension, measure, start_date, end_date), columns=["period_start", "label", measure])
+    df["period_start"] = pd.to_datetime(df["period_start"])
+    df[measure] = pd.to_numeric(df[measure])
+    leaders = df.groupby("label")[measure].sum().nlargest(top).index
+    df["label"] = df["label"].where(df["label"].isin(leaders), "Other")
+    return df.groupby(["period_start", "label"], as_index=False)[measure].sum()
+
+#fetch arguments for one page, built the same way everywhere so calls share the query cache
+def page_request(filters, page_size=25, after=None):
+    return dict(after=after, limit=page_size + 1, **filters)
+
+#fetch arguments for the page display_paged_table(key, ...) will show, without touching its state
+def _page_request(key, filters, page_size):
+    pages = st.session_state.get(f"{key}_pages") if st.session_state.get(f"{key}_filters") == filters else None
+    return page_request(filters, page_size, pages[-1] if pages else None)
+
+#start fetching the page display_paged_table will show in the background, pass the result as prefetched=
+def prefetch_page(key, fetch, filters, page_size=25):
+    request = _page_request(key, filters, page_size)
+    return request, data_version(), submit(fetch, **request)
+
+#display session history one page at a time, fetch(after=..., limit=..., **filters) must return rows newest first
+def display_paged_table(key, fetch, filters, page_size=25, prefetched=None):
+    # Stack of page_key() cursors, one per page visited; reset when the filters change
+    if st.session_state.get(f"{key}_filters") != filters:
+        st.session_state[f"{key}_filters"] = filters
+        st.session_state[f"{key}_pages"] = [None]
+    pages = st.session_state[f"{key}_pages"]
+
+    # Ask for one extra session to know whether an older page exists
+    request = _page_request(key, filters, page_size)
+    # The prefetched rows are only used if nothing was written since and the filters still match
+    if prefetched is not None and prefetched[:2] == (request, data_version()):
+        rows = prefetched[2].result()
+    else:
+        rows = fetch(**request)
+    session_ids = list(dict.fromkeys(row['session_id'] for row in rows))
+    has_older = len(session_ids) > page_size
+    if has_older:
+        page_sessions = set(session_ids[:page_size])
+        rows = [row for row in rows if row['session_id'] in page_sessions]
+
+    st.write(pd.DataFrame(rows))
+
+    col1, col2, col3 = st.columns([1, 4, 1])
+    if col1.button("Newer", key=f"{key}_newer", disabled=len(pages) == 1):
+        pages.pop()
+        st.rerun()
+    col2.caption(f"Page {len(pages)}")
+    if col3.button("Older", key=f"{key}_older", disabled=not has_older):
+        pages.append(page_key(rows[-1]))
+        st.rerun()
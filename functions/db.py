@@ -1,164 +1,755 @@
-import mysql.connector
+import datetime
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import pandas as pd
 import streamlit as st
 
+from functions.backends import backend_from_settings, key_lookup_query, replicas_from_settings
+from functions.config import get_flag, get_setting
+from functions.instrument import fingerprint, instrument_connection, instrumented, record
+
+# Process-wide storage backend shared by every Streamlit session, selected by DB_BACKEND,
+# and the optional read replicas that take the read helpers' queries off it
+_backend = None
+_replicas = None
+_backend_lock = threading.Lock()
+_next_replica = itertools.count()
+# Reads go to the primary for this long after the app writes, so neither the page that wrote nor the
+# shared query cache refilled right after invalidate_cache() sees a replica that hasn't caught up yet
+_read_after_write_seconds = float(get_setting("DB_READ_AFTER_WRITE_SECONDS", 5))
+_last_write = None
+
+def get_backend():
+    """
+    Return the storage backend, creating it from the settings on first use.
+    An embedded database gets its pending migrations applied the first time it is opened.
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _prepare_backend(backend_from_settings())
+    return _backend
+
+def get_replicas():
+    """
+    Return the read replica backends from DB_READ_REPLICAS, an empty list when reads use the primary.
+    Replicas are kept up to date outside of the app, their schema is never touched.
+    """
+    global _replicas
+    if _replicas is None:
+        with _backend_lock:
+            if _replicas is None:
+                _replicas = replicas_from_settings()
+    return _replicas
+
+def set_backend(backend, replicas=()):
+    """
+    Replace the storage backend and its read replicas, e.g. with SQLiteBackends for tests and benchmarks.
+    """
+    global _backend, _replicas, _last_write
+    with _backend_lock:
+        _backend = _prepare_backend(backend)
+        _replicas = list(replicas)
+    invalidate_cache()
+    _last_write = None
+
+def _read_backends():
+    # Replicas in round-robin order with the primary as the last resort,
+    # or only the primary if there are no replicas or the app wrote recently
+    primary = get_backend()
+    replicas = get_replicas()
+    if not replicas or (_last_write is not None and time.monotonic() - _last_write < _read_after_write_seconds):
+        return [primary]
+    start = next(_next_replica) % len(replicas)
+    return replicas[start:] + replicas[:start] + [primary]
+
+def _backend_label(backend):
+    replicas = _replicas or []
+    return f"{backend.name} replica {replicas.index(backend) + 1}" if backend in replicas else backend.name
+
+def _prepare_backend(backend):
+    if backend.embedded:
+        # Imported here, functions.schema depends on this module
+        from functions.schema import migrate
+        migrate(backend)
+    return backend
+
 def get_connection():
-    return mysql.connector.connect(
-        host=st.secrets["DB_HOST"],
-        user=st.secrets["DB_USERNAME"],
-        password=st.secrets["DB_PASSWORD"],
-        database=st.secrets["DB_NAME"]
-    )
+    """
+    Check out a connection from the backend. Calling close() on it hands it back.
+    """
+    return get_backend().connect()
+
+@contextmanager
+def connection(conn=None, read=False):
+    """
+    Check out a pooled connection for the duration of a with-block.
+    Pass an already checked-out connection to reuse it, so several helpers can run on one connection.
+    With read=True the connection may come from a read replica, falling back to the next replica and
+    then to the primary when one can't be reached; use it only for queries that don't write.
+    Queries run on the yielded connection are timed, see functions.instrument.
+    """
+    if conn is not None:
+        conn = instrument_connection(conn)
+        try:
+            yield conn
+        finally:
+            conn.finish()
+        return
+    backends = _read_backends() if read else [get_backend()]
+    for i, backend in enumerate(backends):
+        started = time.perf_counter()
+        try:
+            raw = backend.connect()
+            break
+        except Exception:
+            record("connect", f"{_backend_label(backend)} failed", time.perf_counter() - started)
+            if i == len(backends) - 1:
+                raise
+    record("connect", _backend_label(backend), time.perf_counter() - started)
+    conn = instrument_connection(raw)
+    try:
+        yield conn
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        conn.finish()
+        backend.release(raw)
+
+def pool_stats():
+    """
+    Return a snapshot of the connection pool metrics, with those of each read replica under "replicas".
+    """
+    stats = get_backend().stats()
+    if get_replicas():
+        stats["replicas"] = {_backend_label(replica): replica.stats() for replica in get_replicas()}
+    return stats
+
+# fetch_* results are shared across sessions until they expire or a write invalidates them
+_cache_ttl = float(get_setting("DB_CACHE_TTL", 600))
+_cache_max_entries = int(get_setting("DB_CACHE_MAX_ENTRIES", 64))
+_cached_queries = []
+# Bumped by invalidate_cache(), lets derived objects cached elsewhere key on the current data
+_data_version = 0
+
+def cached_query(func):
+    """
+    Cache a read helper for DB_CACHE_TTL seconds, keeping at most DB_CACHE_MAX_ENTRIES argument combinations.
+    Only calls that miss the cache are timed.
+    """
+    cached = st.cache_data(ttl=_cache_ttl, max_entries=_cache_max_entries, show_spinner=False)(instrumented(func))
+    _cached_queries.append(cached)
+    return cached
+
+def invalidate_cache():
+    """
+    Drop every cached query result, called after writes commit.
+    Reads are sent to the primary for DB_READ_AFTER_WRITE_SECONDS from here on.
+    """
+    global _data_version, _last_write
+    _last_write = time.monotonic()
+    _data_version += 1
+    for cached in _cached_queries:
+        cached.clear()
+
+def data_version():
+    """
+    Counter that changes whenever the app writes to the database.
+    """
+    return _data_version
 
 def verify_password(input_password):
     return input_password == st.secrets["EDIT_PASSWORD"]
 
-def insert_or_get_gun(category, manufacturer, model, caliber, ownership_type, gun_notes):
-    conn = get_connection()
-    cursor = conn.cursor()
-    # Check if gun exists
+# The unique keys the write helpers find existing rows by: table -> (id column, key columns)
+UNIQUE_KEYS = {
+    "gun": ("gun_id", ("manufacturer", "model", "caliber")),
+    "ammo": ("ammo_id", ("manufacturer", "type", "caliber")),
+    "session": ("session_id", ("date",)),
+}
+
+def _insert_or_get(cursor, table, values):
+    id_column, key_columns = UNIQUE_KEYS[table]
+    return get_backend().insert_or_get(cursor, table, id_column, values, key_columns)
+
+def build_key_lookup_query(table, values):
+    """
+    Build (query, params) for the unique key lookup of insert_or_get on a table of UNIQUE_KEYS.
+    """
+    id_column, key_columns = UNIQUE_KEYS[table]
+    return key_lookup_query(table, id_column, key_columns), [values[column] for column in key_columns]
+
+def _upsert_gun(cursor, category, manufacturer, model, caliber, ownership_type, gun_notes):
+    values = dict(name=f"{manufacturer} {model}", category=category, manufacturer=manufacturer, model=model, caliber=caliber, ownership_type=ownership_type, gun_notes=gun_notes)
+    return _insert_or_get(cursor, "gun", values)
+
+def _upsert_ammo(cursor, manufacturer, ammo_type, caliber, ammo_notes):
+    values = dict(manufacturer=manufacturer, type=ammo_type, caliber=caliber, ammo_notes=ammo_notes)
+    return _insert_or_get(cursor, "ammo", values)
+
+def _upsert_session(cursor, date, time, target_type, duration_minutes):
+    # Sessions are unique per date, a second entry on the same day reuses the existing session
+    values = dict(date=date, time=time, target_type=target_type, duration_minutes=duration_minutes)
+    return _insert_or_get(cursor, "session", values)
+
+def _insert_session_detail(cursor, session_id, gun_id, ammo_id, rounds_fired, ammo_cost_total):
     query = """
-        SELECT gun_id FROM gun
-        WHERE manufacturer = %s AND model = %s AND caliber = %s
+        INSERT INTO session_details (session_id, gun_id, ammo_id, rounds_fired, ammo_cost_total)
+        VALUES (%s, %s, %s, %s, %s)
     """
-    cursor.execute(query, (manufacturer, model, caliber))
-    result = cursor.fetchone()
-    if result:
-        gun_id = result[0]
-    else:
-        # Insert new gun
-        query = """
-            INSERT INTO gun (name, category, manufacturer, model, caliber, ownership_type, gun_notes)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """
-        cursor.execute(query, (f"{manufacturer} {model}", category, manufacturer, model, caliber, ownership_type, gun_notes))
+    cursor.execute(query, (session_id, gun_id, ammo_id, rounds_fired, ammo_cost_total))
+
+def _add_to_stats(backend, cursor, table, key, deltas):
+    """
+    Add (id, detail_count, rounds_fired, ammo_cost_total) deltas to gun_stats or ammo_stats, in the SQL of backend.
+    """
+    query = f"""
+        INSERT INTO {table} ({key}, detail_count, rounds_fired, ammo_cost_total)
+        VALUES (%s, %s, %s, %s)
+        {backend.add_on_duplicate(key, ("detail_count", "rounds_fired", "ammo_cost_total"))}
+    """
+    cursor.executemany(query, deltas)
+
+# Periods of the session_rollups table and the first day of the period containing a date;
+# computed here rather than in SQL, the date functions differ between backends
+ROLLUP_PERIODS = ("day", "week", "month")
+
+def period_start(period, date):
+    if isinstance(date, str):
+        date = datetime.date.fromisoformat(date)
+    if period == "day":
+        return date
+    if period == "week":
+        return date - datetime.timedelta(days=date.weekday())
+    if period == "month":
+        return date.replace(day=1)
+    raise ValueError(f"Unknown period: {period}")
+
+ROLLUP_COLUMNS = ("session_count", "session_minutes", "detail_count", "detail_minutes", "rounds_fired", "ammo_cost_total")
+
+def _add_to_rollups(backend, cursor, entries):
+    """
+    Add (date, gun_id, caliber, session_count, session_minutes, detail_count, detail_minutes, rounds_fired,
+    ammo_cost_total) deltas to session_rollups, for every period and for the "total", "gun" and "caliber"
+    dimensions. Entries without a gun_id only count towards the totals; the session columns are only kept
+    for the totals, a session can use several guns and calibers. The SQL is written for backend.
+    """
+    folded = {}
+    for date, gun_id, caliber, *deltas in entries:
+        keys = [("total", "")]
+        if gun_id is not None:
+            keys += [("gun", str(gun_id)), ("caliber", str(caliber or "").strip().casefold())]
+        for period in ROLLUP_PERIODS:
+            start = period_start(period, date)
+            for dimension, dim_key in keys:
+                values = deltas if dimension == "total" else [0, 0] + deltas[2:]
+                key = (period, dimension, dim_key, start)
+                folded[key] = [total + value for total, value in zip(folded.get(key, [0] * len(values)), values)]
+    query = f"""
+        INSERT INTO session_rollups (period, dimension, dim_key, period_start, {", ".join(ROLLUP_COLUMNS)})
+        VALUES (%s, %s, %s, %s, {", ".join(["%s"] * len(ROLLUP_COLUMNS))})
+        {backend.add_on_duplicate("period, dimension, dim_key, period_start", ROLLUP_COLUMNS)}
+    """
+    cursor.executemany(query, [(*key, *values) for key, values in folded.items()])
+
+def build_ammo_calibers_query(ammo_ids):
+    """
+    Build (query, params) for the calibers of the ammo the summary updates fold into the rollups.
+    """
+    ammo_ids = list(ammo_ids)
+    return f"SELECT ammo_id, caliber FROM ammo WHERE ammo_id IN ({', '.join(['%s'] * len(ammo_ids))})", ammo_ids
+
+def _ammo_calibers(cursor, ammo_ids):
+    cursor.execute(*build_ammo_calibers_query(ammo_ids))
+    return dict(cursor.fetchall())
+
+def build_session_summary_query(session_id):
+    """
+    Build (query, params) for the session columns _update_summary() folds into the totals and rollups.
+    """
+    return "SELECT date, duration_minutes FROM session WHERE session_id = %s", [session_id]
+
+def _update_summary(cursor, session_id, sign, session_changed, details):
+    """
+    Apply session_details rows (gun_id, ammo_id, rounds_fired, ammo_cost_total) of one session to the
+    summary tables. sign is 1 for inserted rows and -1 for deleted rows; session_changed is True when the
+    session row itself was created or deleted. Must run while the session row still exists.
+    """
+    backend = get_backend()
+    for table, key, index in (("gun_stats", "gun_id", 0), ("ammo_stats", "ammo_id", 1)):
+        _add_to_stats(backend, cursor, table, key, [(row[index], sign, sign * row[2], sign * row[3]) for row in details])
+
+    cursor.execute(*build_session_summary_query(session_id))
+    date, duration_minutes = cursor.fetchone()
+    session_delta = sign if session_changed else 0
+    detail_delta = sign * len(details)
+    query_totals = """
+        UPDATE log_totals SET
+            session_count = session_count + %s,
+            session_minutes = session_minutes + %s,
+            detail_count = detail_count + %s,
+            detail_minutes = detail_minutes + %s,
+            rounds_fired = rounds_fired + %s,
+            ammo_cost_total = ammo_cost_total + %s
+        WHERE id = 1
+    """
+    cursor.execute(query_totals, (
+        session_delta, session_delta * duration_minutes,
+        detail_delta, detail_delta * duration_minutes,
+        sign * sum(row[2] for row in details),
+        sign * sum(row[3] for row in details)
+    ))
+
+    calibers = _ammo_calibers(cursor, {row[1] for row in details}) if details else {}
+    _add_to_rollups(backend, cursor, [(date, None, None, session_delta, session_delta * duration_minutes, 0, 0, 0, 0)] + [
+        (date, row[0], calibers.get(row[1]), 0, 0, sign, sign * duration_minutes, sign * row[2], sign * row[3])
+        for row in details
+    ])
+
+@instrumented
+def rebuild_summary(conn=None, backend=None):
+    """
+    Recompute the summary tables from the full session history.
+    Only needed once after creating them, they are kept up to date by the write helpers.
+    Pass the backend of conn while the global one isn't set up yet, as the migrations do.
+    """
+    backend = backend or get_backend()
+    with connection(conn) as conn:
+        cursor = conn.cursor()
+        for table, key in (("gun_stats", "gun_id"), ("ammo_stats", "ammo_id")):
+            cursor.execute(f"DELETE FROM {table}")
+            cursor.execute(f"""
+                INSERT INTO {table} ({key}, detail_count, rounds_fired, ammo_cost_total)
+                SELECT {key}, COUNT(*), SUM(rounds_fired), SUM(ammo_cost_total)
+                FROM session_details
+                GROUP BY {key}
+            """)
+        cursor.execute("DELETE FROM log_totals")
+        cursor.execute("""
+            INSERT INTO log_totals (id, session_count, session_minutes, detail_count, detail_minutes, rounds_fired, ammo_cost_total)
+            SELECT
+                1,
+                (SELECT COUNT(*) FROM session),
+                (SELECT COALESCE(SUM(duration_minutes), 0) FROM session),
+                COUNT(*),
+                COALESCE(SUM(s.duration_minutes), 0),
+                COALESCE(SUM(sd.rounds_fired), 0),
+                COALESCE(SUM(sd.ammo_cost_total), 0)
+            FROM session_details sd
+            JOIN session s ON s.session_id = sd.session_id
+        """)
+        # Rollups are folded into periods from per-day groups, a day has at most one session
+        cursor.execute("DELETE FROM session_rollups")
+        cursor.execute("SELECT date, COUNT(*), COALESCE(SUM(duration_minutes), 0) FROM session GROUP BY date")
+        entries = [(date, None, None, count, minutes, 0, 0, 0, 0) for date, count, minutes in cursor.fetchall()]
+        cursor.execute("""
+            SELECT s.date, sd.gun_id, a.caliber, COUNT(*), SUM(s.duration_minutes), SUM(sd.rounds_fired), SUM(sd.ammo_cost_total)
+            FROM session_details sd
+            JOIN session s ON s.session_id = sd.session_id
+            JOIN ammo a ON a.ammo_id = sd.ammo_id
+            GROUP BY s.date, sd.gun_id, a.caliber
+        """)
+        entries += [(date, gun_id, caliber, 0, 0, *values) for date, gun_id, caliber, *values in cursor.fetchall()]
+        if entries:
+            _add_to_rollups(backend, cursor, entries)
         conn.commit()
-        gun_id = cursor.lastrowid
-    conn.close()
+    invalidate_cache()
+
+@instrumented
+def insert_or_get_gun(category, manufacturer, model, caliber, ownership_type, gun_notes, conn=None):
+    with connection(conn) as conn:
+        cursor = conn.cursor()
+        gun_id, created = _upsert_gun(cursor, category, manufacturer, model, caliber, ownership_type, gun_notes)
+        conn.commit()
+    if created:
+        invalidate_cache()
     return gun_id
 
-def insert_or_get_ammo(manufacturer, ammo_type, caliber, ammo_notes):
-    conn = get_connection()
-    cursor = conn.cursor()
-    # Check if ammo exists
-    query = """
-        SELECT ammo_id FROM ammo
-        WHERE manufacturer = %s AND type = %s AND caliber = %s
-    """
-    cursor.execute(query, (manufacturer, ammo_type, caliber))
-    result = cursor.fetchone()
-    if result:
-        ammo_id = result[0]
-    else:
-        # Insert new ammo
-        query = """
-            INSERT INTO ammo (manufacturer, type, caliber, ammo_notes)
-            VALUES (%s, %s, %s, %s)
-        """
-        cursor.execute(query, (manufacturer, ammo_type, caliber, ammo_notes))
+@instrumented
+def insert_or_get_ammo(manufacturer, ammo_type, caliber, ammo_notes, conn=None):
+    with connection(conn) as conn:
+        cursor = conn.cursor()
+        ammo_id, created = _upsert_ammo(cursor, manufacturer, ammo_type, caliber, ammo_notes)
         conn.commit()
-        ammo_id = cursor.lastrowid
-    conn.close()
+    if created:
+        invalidate_cache()
     return ammo_id
 
-def insert_session_and_details(date, time, target_type, duration_minutes, gun_id, ammo_id, rounds_fired, ammo_cost_total):
-    conn = get_connection()
-    cursor = conn.cursor()
+@instrumented
+def insert_session_and_details(date, time, target_type, duration_minutes, gun_id, ammo_id, rounds_fired, ammo_cost_total, conn=None):
+    with connection(conn) as conn:
+        cursor = conn.cursor()
+        session_id, new_session = _upsert_session(cursor, date, time, target_type, duration_minutes)
+        _insert_session_detail(cursor, session_id, gun_id, ammo_id, rounds_fired, ammo_cost_total)
+        _update_summary(cursor, session_id, 1, new_session, [(gun_id, ammo_id, rounds_fired, ammo_cost_total)])
+        conn.commit()
+    invalidate_cache()
+    return session_id
 
-    # Check if a session for the same date already exists
-    query_check = """
-        SELECT session_id FROM session WHERE date = %s
+@instrumented
+def submit_session(date, time, target_type, duration_minutes, gun, ammo, rounds_fired, ammo_cost_total, conn=None):
+    """
+    Resolve the gun, ammo and session and insert the session details in one transaction.
+    gun and ammo are either an existing id or a dict of insert_or_get_gun / insert_or_get_ammo arguments.
     """
-    cursor.execute(query_check, (date,))
-    result = cursor.fetchone()
+    with connection(conn) as conn:
+        cursor = conn.cursor()
+        try:
+            session_id = _submit_session(cursor, date, time, target_type, duration_minutes, gun, ammo, rounds_fired, ammo_cost_total)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    invalidate_cache()
+    return session_id
 
-    if result:
-        session_id = result[0]
-    else:
-        # Otherwise, create a new session
-        query_insert = """
-            INSERT INTO session (date, time, target_type, duration_minutes)
-            VALUES (%s, %s, %s, %s)
-        """
-        cursor.execute(query_insert, (date, time, target_type, duration_minutes))
-        session_id = cursor.lastrowid
+def _submit_session(cursor, date, time, target_type, duration_minutes, gun, ammo, rounds_fired, ammo_cost_total):
+    gun_id, _ = _upsert_gun(cursor, **gun) if isinstance(gun, dict) else (int(gun), False)
+    ammo_id, _ = _upsert_ammo(cursor, **ammo) if isinstance(ammo, dict) else (int(ammo), False)
+    session_id, new_session = _upsert_session(cursor, date, time, target_type, duration_minutes)
+    _insert_session_detail(cursor, session_id, gun_id, ammo_id, rounds_fired, ammo_cost_total)
+    _update_summary(cursor, session_id, 1, new_session, [(gun_id, ammo_id, rounds_fired, ammo_cost_total)])
+    return session_id
 
-    # Insert session details
-    query_details = """
-        INSERT INTO session_details (session_id, gun_id, ammo_id, rounds_fired, ammo_cost_total)
-        VALUES (%s, %s, %s, %s, %s)
+def build_applied_submission_query(submission_id):
+    """
+    Build (query, params) for the session an already applied submission wrote, see apply_submissions().
     """
-    cursor.execute(query_details, (session_id, gun_id, ammo_id, rounds_fired, ammo_cost_total))
+    return "SELECT session_id FROM applied_submissions WHERE submission_id = %s", [submission_id]
 
-    conn.commit()
-    conn.close()
-    return session_id
+@instrumented
+def apply_submissions(submissions, conn=None):
+    """
+    Apply queued submit_session calls in one transaction, see functions/outbox.py.
+    submissions are (submission_id, submit_session kwargs) pairs. A submission_id already recorded in
+    applied_submissions is skipped, so a batch retried after a lost commit acknowledgement is not applied twice.
+    Returns {submission_id: session_id}.
+    """
+    backend = get_backend()
+    results = {}
+    with connection(conn) as conn:
+        cursor = conn.cursor()
+        try:
+            for submission_id, kwargs in submissions:
+                cursor.execute(
+                    f"INSERT INTO applied_submissions (submission_id) VALUES (%s) {backend.ignore_duplicates('submission_id')}",
+                    (submission_id,)
+                )
+                if cursor.rowcount != 1:
+                    cursor.execute(*build_applied_submission_query(submission_id))
+                    results[submission_id] = cursor.fetchone()[0]
+                    continue
+                session_id = _submit_session(cursor, **kwargs)
+                cursor.execute("UPDATE applied_submissions SET session_id = %s WHERE submission_id = %s", (session_id, submission_id))
+                results[submission_id] = session_id
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    invalidate_cache()
+    return results
 
-def delete_most_recent_session():
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    # Find the most recent session
-    query_find = """
+def build_latest_session_query():
+    """
+    Build (query, params) for the most recent session, the one delete_most_recent_session() deletes.
+    """
+    query = """
         SELECT session_id FROM session
         ORDER BY date DESC, time DESC
         LIMIT 1
     """
-    cursor.execute(query_find)
-    result = cursor.fetchone()
-    
-    if result:
+    return query, []
+
+def build_session_details_query(session_id):
+    """
+    Build (query, params) for the summary columns of a session's details, taken out of the summaries on delete.
+    """
+    query = """
+        SELECT gun_id, ammo_id, rounds_fired, ammo_cost_total
+        FROM session_details WHERE session_id = %s
+    """
+    return query, [session_id]
+
+def build_delete_details_query(session_id):
+    """
+    Build (query, params) deleting the details of a session.
+    """
+    return "DELETE FROM session_details WHERE session_id = %s", [session_id]
+
+@instrumented
+def delete_most_recent_session(conn=None):
+    with connection(conn) as conn:
+        cursor = conn.cursor()
+
+        # Find the most recent session
+        cursor.execute(*build_latest_session_query())
+        result = cursor.fetchone()
+
+        if not result:
+            return None
+
         session_id = result[0]
-        
+
+        # Take the deleted rows out of the summary tables before the session row disappears
+        cursor.execute(*build_session_details_query(session_id))
+        _update_summary(cursor, session_id, -1, True, cursor.fetchall())
+
         # Delete session details
-        query_delete_details = """
-            DELETE FROM session_details WHERE session_id = %s
-        """
-        cursor.execute(query_delete_details, (session_id,))
-        
+        cursor.execute(*build_delete_details_query(session_id))
+
         # Delete session
         query_delete_session = """
             DELETE FROM session WHERE session_id = %s
         """
         cursor.execute(query_delete_session, (session_id,))
-        
+
         conn.commit()
-        conn.close()
-        return session_id
-    else:
-        conn.close()
-        return None
+    invalidate_cache()
+    return session_id
 
-def fetch_existing_guns():
-    conn = get_connection()
-    cursor = conn.cursor(dictionary=True)
+def _normalize_key(values):
+    # Compare lookup keys the way the case-insensitive unique keys do
+    return tuple(str(value).casefold() for value in values)
+
+def _lookup_rows(cursor, table, columns, key_columns, keys, batch_size):
+    """
+    Map normalized key tuples to the requested columns of the existing rows of table.
+    """
+    found = {}
+    keys = list(keys)
+    row_placeholder = "(" + ", ".join(["%s"] * len(key_columns)) + ")"
+    for start in range(0, len(keys), batch_size):
+        batch = keys[start:start + batch_size]
+        query = f"""
+            SELECT {", ".join(key_columns)}, {", ".join(columns)}
+            FROM {table}
+            WHERE ({", ".join(key_columns)}) IN ({", ".join([row_placeholder] * len(batch))})
+        """
+        cursor.execute(query, [value for key in batch for value in key])
+        for row in cursor.fetchall():
+            found.setdefault(_normalize_key(row[:len(key_columns)]), row[len(key_columns):])
+    return found
+
+def _gun_key(row):
+    return dict(manufacturer=row["gun_manufacturer"], model=row["gun_model"], caliber=row["gun_caliber"])
+
+def _ammo_key(row):
+    return dict(manufacturer=row["ammo_manufacturer"], type=row["ammo_type"], caliber=row["ammo_caliber"])
+
+def _key_exists(cursor, table, values):
+    cursor.execute(*build_key_lookup_query(table, values))
+    return cursor.fetchone() is not None
+
+def _executemany_batched(cursor, query, rows, batch_size):
+    for start in range(0, len(rows), batch_size):
+        cursor.executemany(query, rows[start:start + batch_size])
+
+@instrumented
+def bulk_insert_sessions(rows, dry_run=False, batch_size=500, conn=None):
+    """
+    Load many session detail rows in one transaction using batched session lookups and executemany.
+    Each row is a dict with date, time, target_type, duration_minutes, gun_category, gun_manufacturer,
+    gun_model, gun_caliber, ownership_type, gun_notes, ammo_manufacturer, ammo_type, ammo_caliber,
+    ammo_notes, rounds_fired and ammo_cost_total. Guns, ammo and sessions are resolved the same way as
+    submit_session; rows sharing a date share the session of the first of them.
+    With dry_run nothing is written. Returns counts of new guns, ammo, sessions and inserted details.
+    """
+    gun_keys, ammo_keys, session_keys = {}, {}, {}
+    for row in rows:
+        gun_keys.setdefault(_normalize_key((row["gun_manufacturer"], row["gun_model"], row["gun_caliber"])), row)
+        ammo_keys.setdefault(_normalize_key((row["ammo_manufacturer"], row["ammo_type"], row["ammo_caliber"])), row)
+        session_keys.setdefault(_normalize_key((row["date"],)), row)
+
+    backend = get_backend()
+    with connection(conn) as conn:
+        cursor = conn.cursor()
+        try:
+            session_lookup = [(row["date"],) for row in session_keys.values()]
+            sessions = _lookup_rows(cursor, "session", ("session_id", "duration_minutes"), ("date",), session_lookup, batch_size)
+            new_sessions = [row for key, row in session_keys.items() if key not in sessions]
+            if dry_run:
+                return dict(
+                    new_guns=sum(not _key_exists(cursor, "gun", _gun_key(row)) for row in gun_keys.values()),
+                    new_ammo=sum(not _key_exists(cursor, "ammo", _ammo_key(row)) for row in ammo_keys.values()),
+                    new_sessions=len(new_sessions),
+                    details=len(rows),
+                )
+
+            # Guns and ammo go through insert-or-get one at a time and rows take the id it returns. The
+            # database may match names casefold() tells apart (MySQL's collation also ignores accents),
+            # so the rows it returns are never matched back to the file by their text
+            guns, ammo, created_guns, created_ammo = {}, {}, 0, 0
+            for key, row in gun_keys.items():
+                guns[key], created = _upsert_gun(
+                    cursor, row["gun_category"], row["gun_manufacturer"], row["gun_model"], row["gun_caliber"],
+                    row["ownership_type"], row["gun_notes"]
+                )
+                created_guns += created
+            for key, row in ammo_keys.items():
+                ammo[key], created = _upsert_ammo(cursor, row["ammo_manufacturer"], row["ammo_type"], row["ammo_caliber"], row["ammo_notes"])
+                created_ammo += created
+            result = dict(new_guns=created_guns, new_ammo=created_ammo, new_sessions=len(new_sessions), details=len(rows))
+
+            # Create the missing sessions, ignoring dates a concurrent writer created in the meantime, then resolve their ids
+            if new_sessions:
+                query = f"""
+                    INSERT INTO session (date, time, target_type, duration_minutes)
+                    VALUES (%s, %s, %s, %s)
+                    {backend.ignore_duplicates("session_id")}
+                """
+                _executemany_batched(cursor, query, [(
+                    row["date"], row["time"], row["target_type"], row["duration_minutes"]
+                ) for row in new_sessions], batch_size)
+                sessions.update(_lookup_rows(cursor, "session", ("session_id", "duration_minutes"), ("date",), [
+                    (row["date"],) for row in new_sessions
+                ], batch_size))
+
+            details = []
+            rollups = [(row["date"], None, None, 1, row["duration_minutes"], 0, 0, 0, 0) for row in new_sessions]
+            for row in rows:
+                session_id, duration_minutes = sessions[_normalize_key((row["date"],))]
+                gun_id = guns[_normalize_key((row["gun_manufacturer"], row["gun_model"], row["gun_caliber"]))]
+                ammo_id = ammo[_normalize_key((row["ammo_manufacturer"], row["ammo_type"], row["ammo_caliber"]))]
+                details.append((session_id, gun_id, ammo_id, row["rounds_fired"], row["ammo_cost_total"], duration_minutes))
+                rollups.append((row["date"], gun_id, row["ammo_caliber"], 0, 0, 1, duration_minutes, row["rounds_fired"], row["ammo_cost_total"]))
+            query = """
+                INSERT INTO session_details (session_id, gun_id, ammo_id, rounds_fired, ammo_cost_total)
+                VALUES (%s, %s, %s, %s, %s)
+            """
+            _executemany_batched(cursor, query, [detail[:5] for detail in details], batch_size)
+
+            # Fold the whole batch into the summary tables at once
+            for table, key, index in (("gun_stats", "gun_id", 1), ("ammo_stats", "ammo_id", 2)):
+                deltas = {}
+                for detail in details:
+                    count, rounds, cost = deltas.get(detail[index], (0, 0, 0))
+                    deltas[detail[index]] = (count + 1, rounds + detail[3], cost + detail[4])
+                _add_to_stats(backend, cursor, table, key, [(item_id, *delta) for item_id, delta in deltas.items()])
+            query_totals = """
+                UPDATE log_totals SET
+                    session_count = session_count + %s,
+                    session_minutes = session_minutes + %s,
+                    detail_count = detail_count + %s,
+                    detail_minutes = detail_minutes + %s,
+                    rounds_fired = rounds_fired + %s,
+                    ammo_cost_total = ammo_cost_total + %s
+                WHERE id = 1
+            """
+            cursor.execute(query_totals, (
+                len(new_sessions),
+                sum(row["duration_minutes"] for row in new_sessions),
+                len(details),
+                sum(detail[5] for detail in details),
+                sum(detail[3] for detail in details),
+                sum(detail[4] for detail in details)
+            ))
+            _add_to_rollups(backend, cursor, rollups)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    invalidate_cache()
+    return result
+
+def _date_filter(column, start_date=None, end_date=None):
+    """
+    Build SQL conditions and params restricting column to an inclusive date range.
+    """
+    conditions, params = [], []
+    if start_date is not None:
+        conditions.append(f"{column} >= %s")
+        params.append(start_date)
+    if end_date is not None:
+        conditions.append(f"{column} <= %s")
+        params.append(end_date)
+    return conditions, params
+
+def _session_history_query(columns, start_date=None, end_date=None, gun_id=None, ammo_id=None, after=None, limit=None):
+    """
+    Build (query, params) for session details joined to their gun and ammo, newest session first.
+    after is the page_key() of the last row of the previous page and limit counts sessions, not rows.
+    """
+    session_conditions, params = _date_filter("date", start_date, end_date)
+    detail_conditions, detail_params = [], []
+    for column, value in (("gun_id", gun_id), ("ammo_id", ammo_id)):
+        if value is not None:
+            session_conditions.append(f"EXISTS (SELECT 1 FROM session_details f WHERE f.session_id = session.session_id AND f.{column} = %s)")
+            params.append(value)
+            detail_conditions.append(f"sd.{column} = %s")
+            detail_params.append(value)
+    if after is not None:
+        # Keyset pagination on (date, time, session_id), served by idx_session_date_time
+        after_date, after_time, after_session_id = after
+        session_conditions.append("(date < %s OR (date = %s AND (time < %s OR (time = %s AND session_id < %s))))")
+        params.extend([after_date, after_date, after_time, after_time, after_session_id])
+    query = f"""
+        SELECT {columns}
+        FROM (
+            SELECT session_id, date, time, target_type, duration_minutes
+            FROM session
+            {"WHERE " + " AND ".join(session_conditions) if session_conditions else ""}
+            ORDER BY date DESC, time DESC, session_id DESC
+            {"LIMIT %s" if limit is not None else ""}
+        ) s
+        JOIN session_details sd ON s.session_id = sd.session_id
+        JOIN gun g ON sd.gun_id = g.gun_id
+        JOIN ammo a ON sd.ammo_id = a.ammo_id
+        {"WHERE " + " AND ".join(detail_conditions) if detail_conditions else ""}
+        ORDER BY s.date DESC, s.time DESC, s.session_id DESC
+    """
+    if limit is not None:
+        params.append(int(limit))
+    return query, params + detail_params
+
+def page_key(row):
+    """
+    Keyset pagination cursor for a session history row, pass it as after= to fetch the next page.
+    """
+    return (row["date"], row["time"], row["session_id"])
+
+def build_existing_guns_query():
+    """
+    Build (query, params) for fetch_existing_guns().
+    """
     query = """
         SELECT gun_id, name, category, manufacturer, model, caliber, ownership_type, gun_notes
         FROM gun
     """
-    cursor.execute(query)
-    result = cursor.fetchall()
-    conn.close()
-    return result
+    return query, []
 
-def fetch_existing_ammo():
-    conn = get_connection()
-    cursor = conn.cursor(dictionary=True)
+@cached_query
+def fetch_existing_guns():
+    return fetch_data(*build_existing_guns_query())
+
+def build_existing_ammo_query():
+    """
+    Build (query, params) for fetch_existing_ammo().
+    """
     query = """
         SELECT ammo_id, manufacturer, type, caliber, ammo_notes
         FROM ammo
     """
-    cursor.execute(query)
-    result = cursor.fetchall()
-    conn.close()
-    return result
+    return query, []
 
-def fetch_recent_sessions():
-    conn = get_connection()
-    cursor = conn.cursor(dictionary=True)
-    query = """
-        SELECT 
+@cached_query
+def fetch_existing_ammo():
+    return fetch_data(*build_existing_ammo_query())
+
+@cached_query
+def fetch_recent_sessions(start_date=None, end_date=None, gun_id=None, ammo_id=None, after=None, limit=None):
+    """
+    Session history for the logging page, newest first, optionally filtered and paged (see page_key).
+    """
+    columns = """
             s.session_id,
             s.date,
+            s.time,
             s.duration_minutes,
             s.target_type,
             g.name AS gun_name,
@@ -166,41 +757,301 @@ def fetch_recent_sessions():
             a.type AS ammo_type,
             a.caliber AS ammo_caliber,
             sd.rounds_fired
-        FROM 
-            session s
-        JOIN 
-            session_details sd ON s.session_id = sd.session_id
-        JOIN 
-            gun g ON sd.gun_id = g.gun_id
-        JOIN 
-            ammo a ON sd.ammo_id = a.ammo_id
-        ORDER BY 
-            s.date ASC, s.time ASC;
-    """
-    cursor.execute(query)
-    result = cursor.fetchall()
-    conn.close()
-    return result
+    """
+    query, params = _session_history_query(columns, start_date, end_date, gun_id, ammo_id, after, limit)
+    return fetch_data(query, params)
 
-def fetch_data(query):
+# Dimensions accepted by aggregate(): output column -> (SQL column, source table)
+AGGREGATE_DIMENSIONS = {
+    "gun_name": ("g.name", "gun"),
+    "gun_manufacturer": ("g.manufacturer", "gun"),
+    "ammo_type": ("a.type", "ammo"),
+    "ammo_manufacturer": ("a.manufacturer", "ammo"),
+    "ammo_caliber": ("a.caliber", "ammo"),
+}
+
+# Measures accepted by aggregate(): output column -> (SQL over session_details, SQL over the summary tables)
+AGGREGATE_MEASURES = {
+    "rounds_fired": ("SUM(sd.rounds_fired)", "SUM(stats.rounds_fired)"),
+    "ammo_cost_total": ("SUM(sd.ammo_cost_total)", "SUM(stats.ammo_cost_total)"),
+    "detail_count": ("COUNT(*)", "SUM(stats.detail_count)"),
+    # 1.0 * keeps SQLite from dividing the integer sums as integers
+    "avg_rounds_fired": ("AVG(sd.rounds_fired)", "1.0 * SUM(stats.rounds_fired) / NULLIF(SUM(stats.detail_count), 0)"),
+    "cost_per_round": (
+        "SUM(sd.ammo_cost_total) / NULLIF(SUM(sd.rounds_fired), 0)",
+        "SUM(stats.ammo_cost_total) / NULLIF(SUM(stats.rounds_fired), 0)",
+    ),
+}
+
+def build_aggregate_query(dimension, measure, start_date=None, end_date=None, limit=None):
     """
-    Fetch data from the database using a raw SQL query.
+    Build (query, params) grouping session details by dimension and computing measure in the database,
+    ordered by measure descending. Without a date range the summary tables are used instead of the history.
+    """
+    if dimension not in AGGREGATE_DIMENSIONS:
+        raise ValueError(f"Unknown dimension: {dimension}")
+    if measure not in AGGREGATE_MEASURES:
+        raise ValueError(f"Unknown measure: {measure}")
+    column, table = AGGREGATE_DIMENSIONS[dimension]
+    detail_expr, summary_expr = AGGREGATE_MEASURES[measure]
+
+    if start_date is None and end_date is None:
+        alias = table[0]
+        query = f"""
+            SELECT {column} AS {dimension}, {summary_expr} AS {measure}
+            FROM {table}_stats stats
+            JOIN {table} {alias} ON {alias}.{table}_id = stats.{table}_id
+            WHERE stats.detail_count > 0
+            GROUP BY {column}
+        """
+        params = []
+    else:
+        conditions, params = _date_filter("s.date", start_date, end_date)
+        query = f"""
+            SELECT {column} AS {dimension}, {detail_expr} AS {measure}
+            FROM session s
+            JOIN session_details sd ON s.session_id = sd.session_id
+            JOIN gun g ON sd.gun_id = g.gun_id
+            JOIN ammo a ON sd.ammo_id = a.ammo_id
+            WHERE {" AND ".join(conditions)}
+            GROUP BY {column}
+        """
+    query += f" ORDER BY {measure} DESC, {dimension} ASC"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(int(limit))
+    return query, params
+
+@cached_query
+def aggregate(dimension, measure, start_date=None, end_date=None, limit=None):
     """
-    conn = get_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute(query)
-    result = cursor.fetchall()
-    conn.close()
+    Group session details by dimension and return [{dimension: ..., measure: ...}] rows,
+    see AGGREGATE_DIMENSIONS and AGGREGATE_MEASURES for the accepted names.
+    """
+    query, params = build_aggregate_query(dimension, measure, start_date, end_date, limit)
+    return fetch_data(query, params)
+
+def build_metrics_query(start_date=None, end_date=None):
+    """
+    Build (query, params) for fetch_metrics(), reading the log_totals summary row unless a date range is given.
+    """
+    if start_date is None and end_date is None:
+        query = """
+            SELECT session_count, session_minutes, detail_count, detail_minutes, rounds_fired, ammo_cost_total
+            FROM log_totals WHERE id = 1
+        """
+        params = []
+    else:
+        session_conditions, session_params = _date_filter("date", start_date, end_date)
+        conditions, params = _date_filter("s.date", start_date, end_date)
+        query = f"""
+            SELECT
+                COUNT(DISTINCT s.session_id) AS session_count,
+                (SELECT COALESCE(SUM(duration_minutes), 0) FROM session WHERE {" AND ".join(session_conditions)}) AS session_minutes,
+                COUNT(*) AS detail_count,
+                COALESCE(SUM(s.duration_minutes), 0) AS detail_minutes,
+                COALESCE(SUM(sd.rounds_fired), 0) AS rounds_fired,
+                COALESCE(SUM(sd.ammo_cost_total), 0) AS ammo_cost_total
+            FROM session s
+            JOIN session_details sd ON s.session_id = sd.session_id
+            WHERE {" AND ".join(conditions)}
+        """
+        params = session_params + params
+    return query, params
+
+@cached_query
+def fetch_metrics(start_date=None, end_date=None):
+    """
+    Session, detail, round and cost totals, from the log_totals summary row unless a date range is given.
+    """
+    result = fetch_data(*build_metrics_query(start_date, end_date))
+    if not result:
+        return dict.fromkeys(("session_count", "session_minutes", "detail_count", "detail_minutes", "rounds_fired", "ammo_cost_total"), 0)
+    return result[0]
+
+def build_most_recent_gun_query(start_date=None, end_date=None):
+    """
+    Build (query, params) for fetch_most_recent_gun().
+    """
+    # The session is picked first from idx_session_date_time, then the last gun added to it
+    conditions, params = _date_filter("date", start_date, end_date)
+    query = f"""
+        SELECT g.name AS gun_name
+        FROM session_details sd
+        JOIN gun g ON sd.gun_id = g.gun_id
+        WHERE sd.session_id = (
+            SELECT session_id FROM session
+            {"WHERE " + " AND ".join(conditions) if conditions else ""}
+            ORDER BY date DESC, time DESC, session_id DESC
+            LIMIT 1
+        )
+        ORDER BY sd.detail_id DESC
+        LIMIT 1
+    """
+    return query, params
+
+@cached_query
+def fetch_most_recent_gun(start_date=None, end_date=None):
+    """
+    Name of the gun used in the most recent session within the date range, or None.
+    When that session used several guns, the one added last.
+    """
+    result = fetch_data(*build_most_recent_gun_query(start_date, end_date))
+    return result[0]["gun_name"] if result else None
+
+# Measures of fetch_trend() and fetch_trend_breakdown(): output column -> SQL over session_rollups
+TREND_MEASURES = {
+    "session_count": "SUM(r.session_count)",
+    "session_minutes": "SUM(r.session_minutes)",
+    "detail_count": "SUM(r.detail_count)",
+    "rounds_fired": "SUM(r.rounds_fired)",
+    "ammo_cost_total": "SUM(r.ammo_cost_total)",
+    "cost_per_round": "SUM(r.ammo_cost_total) / NULLIF(SUM(r.rounds_fired), 0)",
+    "avg_rounds_fired": "1.0 * SUM(r.rounds_fired) / NULLIF(SUM(r.detail_count), 0)",
+}
+
+def _rollup_filter(column, period, start_date=None, end_date=None):
+    # A period is included when it overlaps the date range
+    return _date_filter(column, None if start_date is None else period_start(period, start_date), end_date)
+
+def build_trend_query(period, start_date=None, end_date=None, window=4):
+    """
+    Build (query, params) for fetch_trend().
+    """
+    if period not in ROLLUP_PERIODS:
+        raise ValueError(f"Unknown period: {period}")
+    window = int(window)
+    columns = ",\n".join(f"{expr} AS {measure}" for measure, expr in TREND_MEASURES.items())
+    windows = ",\n".join(
+        f"AVG({measure}) OVER (ORDER BY period_start ROWS BETWEEN {window - 1} PRECEDING AND CURRENT ROW) AS {measure}_avg, "
+        f"LAG({measure}) OVER (ORDER BY period_start) AS {measure}_prev"
+        for measure in TREND_MEASURES
+    )
+    # The windows run over the whole history and the range is applied afterwards,
+    # so the first period in range still has its previous period and a full average
+    conditions, params = _rollup_filter("period_start", period, start_date, end_date)
+    query = f"""
+        SELECT * FROM (
+            SELECT period_start, {", ".join(TREND_MEASURES)}, {windows}
+            FROM (
+                SELECT r.period_start, {columns}
+                FROM session_rollups r
+                WHERE r.period = %s AND r.dimension = 'total' AND r.detail_count > 0
+                GROUP BY r.period_start
+            ) periods
+        ) trend
+        {"WHERE " + " AND ".join(conditions) if conditions else ""}
+        ORDER BY period_start
+    """
+    return query, [period] + params
+
+@cached_query
+def fetch_trend(period, start_date=None, end_date=None, window=4):
+    """
+    One row per period with sessions, oldest first: every TREND_MEASURES column, its rolling average over
+    the last window periods with sessions as <measure>_avg and its value in the previous such period as
+    <measure>_prev. Read from the session_rollups table, the windows are computed in the database.
+    """
+    return fetch_data(*build_trend_query(period, start_date, end_date, window))
+
+def build_trend_breakdown_query(period, dimension, measure, start_date=None, end_date=None):
+    """
+    Build (query, params) for fetch_trend_breakdown().
+    """
+    if period not in ROLLUP_PERIODS:
+        raise ValueError(f"Unknown period: {period}")
+    if measure not in TREND_MEASURES:
+        raise ValueError(f"Unknown measure: {measure}")
+    if dimension == "gun":
+        label, join = "g.name", "JOIN gun g ON CAST(g.gun_id AS CHAR) = r.dim_key"
+    elif dimension == "caliber":
+        label, join = "r.dim_key", ""
+    else:
+        raise ValueError(f"Unknown dimension: {dimension}")
+    conditions, params = _rollup_filter("r.period_start", period, start_date, end_date)
+    query = f"""
+        SELECT r.period_start, {label} AS label, {TREND_MEASURES[measure]} AS {measure}
+        FROM session_rollups r
+        {join}
+        WHERE {" AND ".join(["r.period = %s", "r.dimension = %s", "r.detail_count > 0"] + conditions)}
+        GROUP BY r.period_start, {label}
+        ORDER BY r.period_start, label
+    """
+    return query, [period, dimension] + params
+
+@cached_query
+def fetch_trend_breakdown(period, dimension, measure, start_date=None, end_date=None):
+    """
+    measure per period and gun name or caliber, [{period_start, label, measure}] oldest first.
+    """
+    return fetch_data(*build_trend_breakdown_query(period, dimension, measure, start_date, end_date))
+
+# Identical reads running at the same time share one execution, see fetch_data()
+_coalesce = get_flag("DB_COALESCE", True)
+_flights = {}
+_flights_lock = threading.Lock()
+_flight_stats = {"executed": 0, "coalesced": 0}
+
+def _single_flight(key, func):
+    """
+    Return func(), or the result of the call with the same key already in flight.
+    Joined calls get their own copies of the rows and are recorded as "coalesced" samples.
+    """
+    with _flights_lock:
+        future = _flights.get(key)
+        leader = future is None
+        if leader:
+            future = _flights[key] = Future()
+            _flight_stats["executed"] += 1
+        else:
+            _flight_stats["coalesced"] += 1
+    if leader:
+        try:
+            future.set_result(func())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with _flights_lock:
+                del _flights[key]
+        return future.result()
+    started = time.perf_counter()
+    try:
+        rows = future.result()
+    finally:
+        record("coalesced", fingerprint(key[0]), time.perf_counter() - started)
+    return [dict(row) for row in rows]
+
+def coalesce_stats():
+    """
+    Reads run against the database, reads that joined one already in flight instead, and reads in flight now.
+    """
+    with _flights_lock:
+        return dict(_flight_stats, in_flight=len(_flights))
+
+def _fetch(query, params=None, conn=None):
+    with connection(conn, read=True) as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(query, params)
+        result = cursor.fetchall()
     return result
 
-def fetch_all_data():
+@instrumented
+def fetch_data(query, params=None, conn=None):
     """
-    Fetch all session-related data from the database.
+    Fetch data from the database using a raw SQL query, on a read replica when there are any.
+    Without conn, a call made while the same query with the same params is already running (e.g. many sessions
+    missing the cache at once after a deploy or an expiry) waits for that execution instead of running its own.
     """
-    query = """
-        SELECT 
+    if conn is not None or not _coalesce:
+        return _fetch(query, params, conn)
+    # Keyed on the data version too, a read started before a write is not handed to readers after it
+    return _single_flight((query, tuple(params or ()), _data_version), lambda: _fetch(query, params))
+
+# Columns of the joined session dataset returned by fetch_all_data and iter_all_data_frames
+ALL_DATA_COLUMNS = """
             s.session_id,
             s.date,
+            s.time,
             s.duration_minutes,
             sd.rounds_fired,
             sd.ammo_cost_total,
@@ -210,13 +1061,116 @@ def fetch_all_data():
             a.type AS ammo_type,
             a.caliber AS ammo_caliber,
             a.manufacturer AS ammo_manufacturer
-        FROM 
-            session s
-        JOIN 
-            session_details sd ON s.session_id = sd.session_id
-        JOIN 
-            gun g ON sd.gun_id = g.gun_id
-        JOIN 
-            ammo a ON sd.ammo_id = a.ammo_id;
-    """
-    return fetch_data(query)
+"""
+
+# Compact dtypes for the joined session dataset
+SESSION_DTYPES = {
+    "session_id": "int32",
+    "date": "datetime64[ns]",
+    "time": "timedelta64[ns]",
+    "duration_minutes": "int16",
+    "rounds_fired": "int32",
+    "ammo_cost_total": "float64",
+    "cost_per_round": "float64",
+    "gun_name": "category",
+    "gun_manufacturer": "category",
+    "ammo_type": "category",
+    "ammo_caliber": "category",
+    "ammo_manufacturer": "category",
+}
+
+@cached_query
+def fetch_all_data(start_date=None, end_date=None, gun_id=None, ammo_id=None, after=None, limit=None):
+    """
+    Fetch session-related data from the database, newest first, optionally filtered and paged (see page_key).
+    """
+    query, params = _session_history_query(ALL_DATA_COLUMNS, start_date, end_date, gun_id, ammo_id, after, limit)
+    return fetch_data(query, params)
+
+def _stream(query, params=None, batch_size=1000, conn=None):
+    """
+    Yield (column_names, rows) batches of a raw SQL query from an unbuffered cursor, on a read replica when there are any.
+    """
+    with connection(conn, read=True) as conn:
+        cursor = conn.cursor(buffered=False)
+        try:
+            cursor.execute(query, params)
+            columns = cursor.column_names
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield columns, rows
+        finally:
+            # An abandoned stream still has rows on the wire, drain them so the connection can be reused
+            if conn.unread_result:
+                conn.consume_results()
+            cursor.close()
+
+def iter_rows(query, params=None, batch_size=1000, conn=None):
+    """
+    Stream the rows of a raw SQL query as tuples, holding at most batch_size rows in memory.
+    """
+    for _, rows in _stream(query, params, batch_size, conn):
+        yield from rows
+
+def iter_frames(query, params=None, chunk_size=10000, dtypes=None, conn=None):
+    """
+    Stream a raw SQL query as DataFrame chunks of up to chunk_size rows, cast to dtypes where given.
+    """
+    for columns, rows in _stream(query, params, chunk_size, conn):
+        frame = pd.DataFrame.from_records(rows, columns=columns)
+        if dtypes:
+            frame = frame.astype({column: dtype for column, dtype in dtypes.items() if column in frame.columns})
+        yield frame
+
+def iter_all_data_frames(chunk_size=10000, **filters):
+    """
+    Stream the joined session dataset as typed DataFrame chunks, newest first.
+    Accepts the same filters as fetch_all_data.
+    """
+    query, params = _session_history_query(ALL_DATA_COLUMNS, **filters)
+    yield from iter_frames(query, params, chunk_size, SESSION_DTYPES)
+
+def build_details_after_totals_query(detail_id):
+    """
+    Build (query, params) counting the details after detail_id and their rounds, see functions/snapshot.py.
+    """
+    query = "SELECT COUNT(*) AS new_rows, COALESCE(SUM(rounds_fired), 0) AS new_rounds FROM session_details WHERE detail_id > %s"
+    return query, [detail_id]
+
+def build_details_after_query(detail_id):
+    """
+    Build (query, params) for iter_detail_frames_after().
+    """
+    query = f"""
+        SELECT sd.detail_id, {ALL_DATA_COLUMNS}
+        FROM session_details sd
+        JOIN session s ON s.session_id = sd.session_id
+        JOIN gun g ON sd.gun_id = g.gun_id
+        JOIN ammo a ON sd.ammo_id = a.ammo_id
+        WHERE sd.detail_id > %s
+        ORDER BY sd.detail_id
+    """
+    return query, [detail_id]
+
+def iter_detail_frames_after(detail_id, chunk_size=10000, conn=None):
+    """
+    Stream the joined session dataset of the details added after detail_id as typed DataFrame chunks,
+    in the order they were added and with their detail_id, see functions/snapshot.py.
+    """
+    query, params = build_details_after_query(detail_id)
+    yield from iter_frames(query, params, chunk_size, SESSION_DTYPES, conn)
+
+@instrumented
+def export_all_data_csv(fileobj, chunk_size=10000, **filters):
+    """
+    Write the joined session dataset to fileobj as CSV in chunks. Returns the number of rows written.
+    """
+    written = 0
+    for frame in iter_all_data_frames(chunk_size, **filters):
+        # Write times as HH:MM:SS rather than as timedelta strings
+        frame["time"] = (pd.Timestamp(0) + frame["time"]).dt.strftime("%H:%M:%S")
+        frame.to_csv(fileobj, header=written == 0, index=False)
+        written += len(frame)
+    return written
@@ -0,0 +1,202 @@
+import functools
+import logging
+import logging.handlers
+import math
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from functions.config import get_setting
+
+# Process-wide timing samples shared by every Streamlit session, see summary()
+SAMPLES_PER_NAME = int(get_setting("INSTRUMENT_SAMPLES", 1000))
+SLOW_QUERY_MS = float(get_setting("SLOW_QUERY_MS", 500))
+SLOW_QUERY_LOG = get_setting("SLOW_QUERY_LOG", "slow_queries.log")
+SLOW_QUERY_LOG_BYTES = int(get_setting("SLOW_QUERY_LOG_BYTES", 1_000_000))
+SLOW_QUERY_LOG_BACKUPS = int(get_setting("SLOW_QUERY_LOG_BACKUPS", 3))
+
+# kind -> name -> deque of sample dicts, every sample has "seconds"
+_samples = defaultdict(lambda: defaultdict(lambda: deque(maxlen=SAMPLES_PER_NAME)))
+_lock = threading.Lock()
+_slow_log = None
+
+def _slow_query_logger():
+    global _slow_log
+    if _slow_log is None and SLOW_QUERY_LOG:
+        logger = logging.getLogger("shooting_log.slow_queries")
+        if not logger.handlers:
+            handler = logging.handlers.RotatingFileHandler(SLOW_QUERY_LOG, maxBytes=SLOW_QUERY_LOG_BYTES, backupCount=SLOW_QUERY_LOG_BACKUPS)
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+        _slow_log = logger
+    return _slow_log
+
+def record(kind, name, seconds, **fields):
+    """
+    Store one timing sample, e.g. record("section", "dashboard/charts", 0.12).
+    """
+    sample = dict(fields, seconds=seconds)
+    with _lock:
+        _samples[kind][name].append(sample)
+
+@contextmanager
+def timed(name, kind="section"):
+    """
+    Time the body of a with-block, e.g. a page section or a chart build.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(kind, name, time.perf_counter() - started)
+
+def instrumented(func):
+    """
+    Record the wall time of every call to a db helper under its name.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with timed(func.__name__, kind="helper"):
+            return func(*args, **kwargs)
+    return wrapper
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(query):
+    """
+    Normalize a query to its shape: literals and placeholders become ?, value lists collapse and whitespace is squeezed.
+    """
+    query = re.sub(r"'(?:[^'\\]|\\.)*'", "?", query)
+    query = re.sub(r"%s|\b\d+(?:\.\d+)?\b", "?", query)
+    query = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(?+)", query)
+    query = re.sub(r"\(\?\+\)(?:\s*,\s*\(\?\+\))+", "(?+), ...", query)
+    return re.sub(r"\s+", " ", query).strip()
+
+def _record_query(query, execute_seconds, fetch_seconds, rows):
+    seconds = execute_seconds + fetch_seconds
+    name = fingerprint(query)
+    record("query", name, seconds, execute=execute_seconds, fetch=fetch_seconds, rows=rows)
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        logger = _slow_query_logger()
+        if logger is not None:
+            logger.info("%.1f ms (execute %.1f ms, fetch %.1f ms) rows=%d %s", seconds * 1000, execute_seconds * 1000, fetch_seconds * 1000, rows, name)
+
+class _Cursor:
+    # Times execute and fetch calls; a query is recorded when the next one starts, on close()
+    # or when the owning connection() block ends
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._pending = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _execute(self, method, query, args):
+        self.finish()
+        started = time.perf_counter()
+        try:
+            return method(query, *args)
+        finally:
+            self._pending = [query, time.perf_counter() - started, 0.0, None]
+
+    def execute(self, query, *args, **kwargs):
+        return self._execute(functools.partial(self._cursor.execute, **kwargs), query, args)
+
+    def executemany(self, query, *args, **kwargs):
+        return self._execute(functools.partial(self._cursor.executemany, **kwargs), query, args)
+
+    def _fetch(self, method, *args):
+        started = time.perf_counter()
+        result = method(*args)
+        if self._pending is not None:
+            self._pending[2] += time.perf_counter() - started
+            rows = 0 if result is None else 1 if not isinstance(result, list) else len(result)
+            self._pending[3] = (self._pending[3] or 0) + rows
+        return result
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._fetch(self._cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall)
+
+    def finish(self):
+        if self._pending is not None:
+            query, execute_seconds, fetch_seconds, rows = self._pending
+            self._pending = None
+            if rows is None:
+                # Nothing fetched, count the rows written instead
+                rows = max(self._cursor.rowcount or 0, 0)
+            _record_query(query, execute_seconds, fetch_seconds, rows)
+
+    def close(self):
+        self.finish()
+        return self._cursor.close()
+
+class InstrumentedConnection:
+    """
+    Wraps a backend connection so its cursors record every query, see functions.db.connection().
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._cursors = []
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        cursor = _Cursor(self._conn.cursor(*args, **kwargs))
+        self._cursors.append(cursor)
+        return cursor
+
+    def finish(self):
+        """
+        Record the queries still pending on this connection's cursors.
+        """
+        cursors, self._cursors = self._cursors, []
+        for cursor in cursors:
+            cursor.finish()
+
+def instrument_connection(conn):
+    return conn if isinstance(conn, InstrumentedConnection) else InstrumentedConnection(conn)
+
+def _percentile(values, fraction):
+    # Nearest-rank percentile of sorted values
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+def summary(kind):
+    """
+    Per-name statistics of the recorded samples of one kind ("connect", "query", "coalesced", "helper", "section" or "page"),
+    slowest total time first. Times are in milliseconds.
+    """
+    with _lock:
+        samples = {name: list(values) for name, values in _samples[kind].items()}
+    rows = []
+    for name, values in samples.items():
+        seconds = sorted(sample["seconds"] for sample in values)
+        row = dict(
+            name=name,
+            count=len(seconds),
+            p50_ms=_percentile(seconds, 0.5) * 1000,
+            p95_ms=_percentile(seconds, 0.95) * 1000,
+            p99_ms=_percentile(seconds, 0.99) * 1000,
+            max_ms=seconds[-1] * 1000,
+            total_ms=sum(seconds) * 1000,
+        )
+        if kind == "query":
+            row["avg_execute_ms"] = sum(sample["execute"] for sample in values) / len(values) * 1000
+            row["avg_fetch_ms"] = sum(sample["fetch"] for sample in values) / len(values) * 1000
+            row["avg_rows"] = sum(sample["rows"] for sample in values) / len(values)
+        rows.append(row)
+    return sorted(rows, key=lambda row: row["total_ms"], reverse=True)
+
+def reset():
+    with _lock:
+        _samples.clear()
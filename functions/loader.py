@@ -0,0 +1,34 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from functions.config import get_setting
+
+# Shared by every session and sized to the connection pool, so extra loads queue here for a
+# thread instead of holding a thread while they wait for (or time out on) a pooled connection
+_executor = ThreadPoolExecutor(max_workers=int(get_setting("DB_POOL_SIZE", 5)), thread_name_prefix="loader")
+
+def submit(func, *args, **kwargs):
+    """
+    Run func(*args, **kwargs) on the loader thread pool and return a Future for its result.
+    The call gets the calling script's run context, so cached helpers behave as on the main thread.
+    At most DB_POOL_SIZE calls run at once, the rest wait for a free thread in submission order.
+    """
+    ctx = get_script_run_ctx()
+
+    def run():
+        # Pool threads are reused across sessions, attach the submitter's context to each call
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return func(*args, **kwargs)
+
+    return _executor.submit(run)
+
+def iter_completed(futures):
+    """
+    Yield (name, result) for a {name: Future} dict in the order the results arrive.
+    Exceptions raised by a call are re-raised here.
+    """
+    names = {future: name for name, future in futures.items()}
+    for future in as_completed(names):
+        yield names[future], future.result()
@@ -0,0 +1,326 @@
+import datetime
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+if __name__ == "__main__":
+    # Allow `python functions/outbox.py`; appended so the pages in the repo root don't shadow stdlib modules
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from functions.config import get_setting
+from functions.db import apply_submissions
+
+# Submissions from the logging form are written to a local SQLite file first and a background
+# thread drains them to the database, so a slow or unreachable database never blocks or loses an entry.
+# data/ is a volume in the docker image, the outbox outlives the container
+OUTBOX_PATH = get_setting("OUTBOX_PATH", os.path.join("data", "outbox.sqlite3"))
+BATCH_SIZE = int(get_setting("OUTBOX_BATCH_SIZE", 50))
+RETRY_BASE = float(get_setting("OUTBOX_RETRY_BASE", 2))
+RETRY_MAX = float(get_setting("OUTBOX_RETRY_MAX", 300))
+POLL_SECONDS = float(get_setting("OUTBOX_POLL_SECONDS", 30))
+# An entry still failing after this many attempts is set aside as 'failed' until it is retried or discarded
+MAX_ATTEMPTS = int(get_setting("OUTBOX_MAX_ATTEMPTS", 20))
+KEEP_DAYS = float(get_setting("OUTBOX_KEEP_DAYS", 7))
+# An identical entry queued again within this many seconds is taken as a double submit
+DEDUPE_SECONDS = float(get_setting("OUTBOX_DEDUPE_SECONDS", 60))
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS outbox (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        submission_id TEXT NOT NULL UNIQUE,
+        payload TEXT NOT NULL,
+        payload_hash TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL,
+        last_error TEXT,
+        session_id INTEGER,
+        flushed_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at, seq);
+    CREATE INDEX IF NOT EXISTS idx_outbox_hash ON outbox (payload_hash, created_at);
+"""
+
+_schema_lock = threading.Lock()
+_schema_ready = set()
+_flusher = None
+_flusher_lock = threading.Lock()
+_wake = threading.Event()
+
+def _now():
+    return time.time()
+
+def _connect(path=None):
+    path = path or OUTBOX_PATH
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    if path not in _schema_ready:
+        with _schema_lock:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            _schema_ready.add(path)
+    # FULL syncs every commit to disk, an entry acknowledged in the form survives a crash
+    conn.execute("PRAGMA synchronous=FULL")
+    return conn
+
+def _encode(value):
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    raise TypeError(f"Cannot queue {type(value).__name__} values")
+
+def _decode(payload):
+    kwargs = json.loads(payload)
+    kwargs["date"] = datetime.date.fromisoformat(kwargs["date"])
+    kwargs["time"] = datetime.time.fromisoformat(kwargs["time"])
+    return kwargs
+
+def enqueue_session(date, time, target_type, duration_minutes, gun, ammo, rounds_fired, ammo_cost_total, path=None):
+    """
+    Queue a submit_session call and return its submission id, applied later by the flusher.
+    gun and ammo are ids or dicts as for submit_session. Re-queueing the same entry within
+    OUTBOX_DEDUPE_SECONDS returns the id of the first one instead of adding it twice.
+    """
+    kwargs = dict(
+        date=date, time=time, target_type=target_type, duration_minutes=duration_minutes,
+        gun=gun, ammo=ammo, rounds_fired=rounds_fired, ammo_cost_total=ammo_cost_total,
+    )
+    payload = json.dumps(kwargs, default=_encode, sort_keys=True)
+    payload_hash = hashlib.sha256(payload.encode()).hexdigest()
+    now = _now()
+    conn = _connect(path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        duplicate = conn.execute(
+            "SELECT submission_id FROM outbox WHERE payload_hash = ? AND created_at >= ? AND status != 'failed' ORDER BY seq DESC LIMIT 1",
+            (payload_hash, now - DEDUPE_SECONDS)
+        ).fetchone()
+        if duplicate:
+            conn.execute("ROLLBACK")
+            return duplicate[0]
+        submission_id = uuid.uuid4().hex
+        conn.execute(
+            "INSERT INTO outbox (submission_id, payload, payload_hash, created_at, next_attempt_at) VALUES (?, ?, ?, ?, ?)",
+            (submission_id, payload, payload_hash, now, now)
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    _wake.set()
+    return submission_id
+
+def _backoff(attempts):
+    # Exponential with jitter, so a recovering database isn't hit by every entry at once
+    return min(RETRY_MAX, RETRY_BASE * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+
+def _mark_flushed(conn, results):
+    now = _now()
+    conn.executemany(
+        "UPDATE outbox SET status = 'flushed', session_id = ?, flushed_at = ?, last_error = NULL WHERE submission_id = ?",
+        [(session_id, now, submission_id) for submission_id, session_id in results.items()]
+    )
+
+def _permanent(error):
+    # The entry itself is rejected by the database (a constraint or a value out of range), retrying won't help
+    return type(error).__name__ in ("IntegrityError", "DataError")
+
+def _mark_failed(conn, rows, error):
+    now = _now()
+    message = f"{type(error).__name__}: {error}"
+    conn.executemany(
+        "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ?, status = ? WHERE submission_id = ?",
+        [
+            (attempts + 1, now + _backoff(attempts + 1), message,
+             "failed" if _permanent(error) or attempts + 1 >= MAX_ATTEMPTS else "pending", submission_id)
+            for submission_id, _, attempts in rows
+        ]
+    )
+
+def flush(path=None, batch_size=None):
+    """
+    Apply the due pending entries to the database, one transaction per batch of OUTBOX_BATCH_SIZE.
+    A failing batch is retried entry by entry so one bad entry doesn't hold back the rest;
+    if the first two entries fail on their own too the database is taken as unavailable and the batch backs off.
+    Entries the database rejects, or still failing after OUTBOX_MAX_ATTEMPTS, are set aside as 'failed'.
+    Returns the number of entries flushed.
+    """
+    batch_size = batch_size or BATCH_SIZE
+    conn = _connect(path)
+    flushed = 0
+    try:
+        while True:
+            rows = conn.execute(
+                "SELECT submission_id, payload, attempts FROM outbox WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY seq LIMIT ?",
+                (_now(), batch_size)
+            ).fetchall()
+            if not rows:
+                break
+            try:
+                results = apply_submissions([(submission_id, _decode(payload)) for submission_id, payload, _ in rows])
+                _mark_flushed(conn, results)
+                flushed += len(results)
+            except Exception as e:
+                if len(rows) == 1:
+                    _mark_failed(conn, rows, e)
+                    continue
+                applied = 0
+                for i, row in enumerate(rows):
+                    try:
+                        results = apply_submissions([(row[0], _decode(row[1]))])
+                        _mark_flushed(conn, results)
+                        applied += 1
+                    except Exception as row_error:
+                        if i == 1 and not applied and not _permanent(row_error):
+                            _mark_failed(conn, rows[1:], row_error)
+                            break
+                        _mark_failed(conn, [row], row_error)
+                flushed += applied
+            if len(rows) < batch_size:
+                break
+        conn.execute(
+            "DELETE FROM outbox WHERE status = 'flushed' AND flushed_at < ?",
+            (_now() - KEEP_DAYS * 86400,)
+        )
+    finally:
+        conn.close()
+    return flushed
+
+def _next_due(path=None):
+    # Seconds until the earliest pending entry is due, POLL_SECONDS when nothing is pending
+    conn = _connect(path)
+    try:
+        due = conn.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'").fetchone()[0]
+    finally:
+        conn.close()
+    return POLL_SECONDS if due is None else min(POLL_SECONDS, max(0.0, due - _now()))
+
+def _run_flusher():
+    while True:
+        try:
+            flush()
+            delay = _next_due()
+        except Exception:
+            # The outbox file itself is unavailable, try again on the next poll
+            delay = POLL_SECONDS
+        _wake.wait(delay)
+        _wake.clear()
+
+def ensure_flusher():
+    """
+    Start the process-wide flusher thread unless it is running. It flushes whenever an entry is
+    queued, when a backed-off entry is due and every OUTBOX_POLL_SECONDS.
+    Entries queued before a restart are picked up once the next session starts the flusher.
+    """
+    global _flusher
+    with _flusher_lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_run_flusher, name="outbox-flusher", daemon=True)
+            _flusher.start()
+    return _flusher
+
+def status(path=None):
+    """
+    Counts of pending, failed and flushed entries, how many pending ones have failed at least once,
+    the age in seconds of the oldest pending entry and the most recent error of a pending one.
+    """
+    conn = _connect(path)
+    try:
+        pending, failing, oldest = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(attempts > 0), 0), MIN(created_at) FROM outbox WHERE status = 'pending'"
+        ).fetchone()
+        flushed = conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'flushed'").fetchone()[0]
+        failed = conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'failed'").fetchone()[0]
+        last_error = conn.execute(
+            "SELECT last_error FROM outbox WHERE status = 'pending' AND last_error IS NOT NULL ORDER BY next_attempt_at DESC LIMIT 1"
+        ).fetchone()
+    finally:
+        conn.close()
+    return dict(
+        pending=pending,
+        failing=failing,
+        failed=failed,
+        flushed=flushed,
+        oldest_pending_seconds=None if oldest is None else _now() - oldest,
+        last_error=last_error[0] if last_error else None,
+    )
+
+def submission_states(submission_ids, path=None):
+    """
+    Return {submission_id: (status, session_id)} for the given ids, session_id is None until flushed.
+    """
+    submission_ids = list(submission_ids)
+    if not submission_ids:
+        return {}
+    conn = _connect(path)
+    try:
+        rows = conn.execute(
+            f"SELECT submission_id, status, session_id FROM outbox WHERE submission_id IN ({', '.join('?' * len(submission_ids))})",
+            submission_ids
+        ).fetchall()
+    finally:
+        conn.close()
+    return {submission_id: (state, session_id) for submission_id, state, session_id in rows}
+
+def failed_entries(path=None):
+    """
+    The entries set aside as 'failed', oldest first, as dicts with the submit_session kwargs,
+    submission_id, created_at, attempts and last_error.
+    """
+    conn = _connect(path)
+    try:
+        rows = conn.execute(
+            "SELECT submission_id, payload, created_at, attempts, last_error FROM outbox WHERE status = 'failed' ORDER BY seq"
+        ).fetchall()
+    finally:
+        conn.close()
+    return [
+        dict(_decode(payload), submission_id=submission_id, created_at=created_at, attempts=attempts, last_error=last_error)
+        for submission_id, payload, created_at, attempts, last_error in rows
+    ]
+
+def retry_failed(submission_ids, path=None):
+    """
+    Queue failed entries again with a fresh set of attempts. Returns the number of entries queued.
+    """
+    submission_ids = list(submission_ids)
+    conn = _connect(path)
+    try:
+        retried = conn.executemany(
+            "UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = ? WHERE submission_id = ? AND status = 'failed'",
+            [(_now(), submission_id) for submission_id in submission_ids]
+        ).rowcount
+    finally:
+        conn.close()
+    _wake.set()
+    return retried
+
+def discard_failed(submission_ids, path=None):
+    """
+    Delete failed entries, their sessions are never written. Returns the number of entries deleted.
+    """
+    submission_ids = list(submission_ids)
+    conn = _connect(path)
+    try:
+        discarded = conn.executemany(
+            "DELETE FROM outbox WHERE submission_id = ? AND status = 'failed'",
+            [(submission_id,) for submission_id in submission_ids]
+        ).rowcount
+    finally:
+        conn.close()
+    return discarded
+
+if __name__ == "__main__":
+    flushed = flush()
+    state = status()
+    print(f"Flushed {flushed}, {state['pending']} pending, {state['failed']} failed" + (f", last error: {state['last_error']}" if state["last_error"] else ""))
@@ -0,0 +1,50 @@
+import importlib
+import time
+
+import streamlit as st
+
+from functions.catalog import get_catalog
+from functions.dash import aggregate_frame, page_request
+from functions.db import fetch_all_data, fetch_metrics, fetch_recent_sessions, get_backend, get_replicas
+from functions.instrument import record
+from functions.loader import submit
+
+# The caches and connections are per process, so warming them has to happen inside the Streamlit
+# server; Streamlit has no startup hook, this runs on the first page view of the process
+
+def _open_pools():
+    # A MySQL pool opens all of its connections when it is created
+    for backend in [get_backend()] + get_replicas():
+        backend.release(backend.connect())
+
+def _warm(name, func, *args, **kwargs):
+    started = time.perf_counter()
+    try:
+        func(*args, **kwargs)
+    finally:
+        record("section", f"prewarm/{name}", time.perf_counter() - started)
+
+def prewarm():
+    """
+    Open the connection pools and fill the shared caches the first page views read, all at once.
+    The arguments match those of the pages' calls exactly, st.cache_data keys on them.
+    Returns {name: Future}; a failed step only shows up in its Future, the page then runs the query itself.
+    """
+    steps = {
+        "pools": (_open_pools,),
+        "catalog": (get_catalog,),
+        "metrics": (fetch_metrics, None, None),
+        "popular_gun": (aggregate_frame, "gun_name", "detail_count", None, None, 1),
+        "recent_sessions": (lambda: fetch_recent_sessions(**page_request(dict(start_date=None, end_date=None, gun_id=None, ammo_id=None))),),
+        "session_data": (lambda: fetch_all_data(**page_request(dict(start_date=None, end_date=None))),),
+        # The dashboard imports plotly.express when it draws its first chart
+        "plotly": (importlib.import_module, "plotly.express"),
+    }
+    return {name: submit(_warm, name, *step) for name, step in steps.items()}
+
+@st.cache_resource(show_spinner=False)
+def start_prewarm():
+    """
+    Run prewarm() once per process, in the background.
+    """
+    return prewarm()
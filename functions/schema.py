@@ -0,0 +1,528 @@
+import argparse
+import datetime
+import os
+import sys
+
+if __name__ == "__main__":
+    # Allow `python functions/schema.py`; appended so the pages in the repo root don't shadow stdlib modules
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from functions import db
+from functions.db import get_backend, rebuild_summary
+
+# Summary tables kept up to date by the write helpers in functions/db.py,
+# session_rollups holds the same totals per day, week and month for the trends
+SUMMARY_TABLES = ["gun_stats", "ammo_stats", "log_totals", "session_rollups"]
+
+# CREATE TABLE statements per backend, in dependency order, as created by migration 1.
+# IF NOT EXISTS lets a database set up before migrations were versioned adopt them as it is.
+# applied_submissions records the queued submissions already written, see functions/outbox.py
+TABLES = {
+    "mysql": {
+        "gun": """
+            CREATE TABLE IF NOT EXISTS gun (
+                gun_id INT AUTO_INCREMENT PRIMARY KEY,
+                name VARCHAR(255) NOT NULL,
+                category VARCHAR(50),
+                manufacturer VARCHAR(100) NOT NULL,
+                model VARCHAR(100) NOT NULL,
+                caliber VARCHAR(50) NOT NULL,
+                ownership_type VARCHAR(50),
+                gun_notes TEXT
+            )
+        """,
+        "ammo": """
+            CREATE TABLE IF NOT EXISTS ammo (
+                ammo_id INT AUTO_INCREMENT PRIMARY KEY,
+                manufacturer VARCHAR(100) NOT NULL,
+                type VARCHAR(100) NOT NULL,
+                caliber VARCHAR(50) NOT NULL,
+                ammo_notes TEXT
+            )
+        """,
+        "session": """
+            CREATE TABLE IF NOT EXISTS session (
+                session_id INT AUTO_INCREMENT PRIMARY KEY,
+                date DATE NOT NULL,
+                time TIME NOT NULL,
+                target_type VARCHAR(50),
+                duration_minutes INT NOT NULL
+            )
+        """,
+        "session_details": """
+            CREATE TABLE IF NOT EXISTS session_details (
+                detail_id INT AUTO_INCREMENT PRIMARY KEY,
+                session_id INT NOT NULL,
+                gun_id INT NOT NULL,
+                ammo_id INT NOT NULL,
+                rounds_fired INT NOT NULL,
+                ammo_cost_total DECIMAL(10, 2) NOT NULL
+            )
+        """,
+        "gun_stats": """
+            CREATE TABLE IF NOT EXISTS gun_stats (
+                gun_id INT PRIMARY KEY,
+                detail_count INT NOT NULL DEFAULT 0,
+                rounds_fired BIGINT NOT NULL DEFAULT 0,
+                ammo_cost_total DECIMAL(12, 2) NOT NULL DEFAULT 0
+            )
+        """,
+        "ammo_stats": """
+            CREATE TABLE IF NOT EXISTS ammo_stats (
+                ammo_id INT PRIMARY KEY,
+                detail_count INT NOT NULL DEFAULT 0,
+                rounds_fired BIGINT NOT NULL DEFAULT 0,
+                ammo_cost_total DECIMAL(12, 2) NOT NULL DEFAULT 0
+            )
+        """,
+        "applied_submissions": """
+            CREATE TABLE IF NOT EXISTS applied_submissions (
+                submission_id CHAR(32) PRIMARY KEY,
+                session_id INT,
+                applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        """,
+        "log_totals": """
+            CREATE TABLE IF NOT EXISTS log_totals (
+                id TINYINT PRIMARY KEY,
+                session_count INT NOT NULL DEFAULT 0,
+                session_minutes BIGINT NOT NULL DEFAULT 0,
+                detail_count INT NOT NULL DEFAULT 0,
+                detail_minutes BIGINT NOT NULL DEFAULT 0,
+                rounds_fired BIGINT NOT NULL DEFAULT 0,
+                ammo_cost_total DECIMAL(14, 2) NOT NULL DEFAULT 0
+            )
+        """,
+        "session_rollups": """
+            CREATE TABLE IF NOT EXISTS session_rollups (
+                period VARCHAR(5) NOT NULL,
+                dimension VARCHAR(7) NOT NULL,
+                dim_key VARCHAR(64) NOT NULL,
+                period_start DATE NOT NULL,
+                session_count INT NOT NULL DEFAULT 0,
+                session_minutes BIGINT NOT NULL DEFAULT 0,
+                detail_count INT NOT NULL DEFAULT 0,
+                detail_minutes BIGINT NOT NULL DEFAULT 0,
+                rounds_fired BIGINT NOT NULL DEFAULT 0,
+                ammo_cost_total DECIMAL(12, 2) NOT NULL DEFAULT 0,
+                PRIMARY KEY (period, dimension, dim_key, period_start)
+            )
+        """,
+    },
+    # NOCASE matches the case-insensitive MySQL collation of the lookup keys,
+    # REAL keeps cost arithmetic in floating point
+    "sqlite": {
+        "gun": """
+            CREATE TABLE IF NOT EXISTS gun (
+                gun_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                category TEXT,
+                manufacturer TEXT NOT NULL COLLATE NOCASE,
+                model TEXT NOT NULL COLLATE NOCASE,
+                caliber TEXT NOT NULL COLLATE NOCASE,
+                ownership_type TEXT,
+                gun_notes TEXT
+            )
+        """,
+        "ammo": """
+            CREATE TABLE IF NOT EXISTS ammo (
+                ammo_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                manufacturer TEXT NOT NULL COLLATE NOCASE,
+                type TEXT NOT NULL COLLATE NOCASE,
+                caliber TEXT NOT NULL COLLATE NOCASE,
+                ammo_notes TEXT
+            )
+        """,
+        "session": """
+            CREATE TABLE IF NOT EXISTS session (
+                session_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date TEXT NOT NULL,
+                time TEXT NOT NULL,
+                target_type TEXT,
+                duration_minutes INTEGER NOT NULL
+            )
+        """,
+        "session_details": """
+            CREATE TABLE IF NOT EXISTS session_details (
+                detail_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id INTEGER NOT NULL REFERENCES session (session_id),
+                gun_id INTEGER NOT NULL REFERENCES gun (gun_id),
+                ammo_id INTEGER NOT NULL REFERENCES ammo (ammo_id),
+                rounds_fired INTEGER NOT NULL,
+                ammo_cost_total REAL NOT NULL
+            )
+        """,
+        "gun_stats": """
+            CREATE TABLE IF NOT EXISTS gun_stats (
+                gun_id INTEGER PRIMARY KEY,
+                detail_count INTEGER NOT NULL DEFAULT 0,
+                rounds_fired INTEGER NOT NULL DEFAULT 0,
+                ammo_cost_total REAL NOT NULL DEFAULT 0
+            )
+        """,
+        "ammo_stats": """
+            CREATE TABLE IF NOT EXISTS ammo_stats (
+                ammo_id INTEGER PRIMARY KEY,
+                detail_count INTEGER NOT NULL DEFAULT 0,
+                rounds_fired INTEGER NOT NULL DEFAULT 0,
+                ammo_cost_total REAL NOT NULL DEFAULT 0
+            )
+        """,
+        "applied_submissions": """
+            CREATE TABLE IF NOT EXISTS applied_submissions (
+                submission_id TEXT PRIMARY KEY,
+                session_id INTEGER,
+                applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        """,
+        "log_totals": """
+            CREATE TABLE IF NOT EXISTS log_totals (
+                id INTEGER PRIMARY KEY,
+                session_count INTEGER NOT NULL DEFAULT 0,
+                session_minutes INTEGER NOT NULL DEFAULT 0,
+                detail_count INTEGER NOT NULL DEFAULT 0,
+                detail_minutes INTEGER NOT NULL DEFAULT 0,
+                rounds_fired INTEGER NOT NULL DEFAULT 0,
+                ammo_cost_total REAL NOT NULL DEFAULT 0
+            )
+        """,
+        "session_rollups": """
+            CREATE TABLE IF NOT EXISTS session_rollups (
+                period TEXT NOT NULL,
+                dimension TEXT NOT NULL,
+                dim_key TEXT NOT NULL,
+                period_start TEXT NOT NULL,
+                session_count INTEGER NOT NULL DEFAULT 0,
+                session_minutes INTEGER NOT NULL DEFAULT 0,
+                detail_count INTEGER NOT NULL DEFAULT 0,
+                detail_minutes INTEGER NOT NULL DEFAULT 0,
+                rounds_fired INTEGER NOT NULL DEFAULT 0,
+                ammo_cost_total REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (period, dimension, dim_key, period_start)
+            )
+        """,
+    },
+}
+
+# (table, index name, columns, unique) created by migration 1
+# The unique keys back the insert-or-get lookups in functions/db.py
+INDEXES = [
+    ("gun", "uq_gun_lookup", ("manufacturer", "model", "caliber"), True),
+    ("ammo", "uq_ammo_lookup", ("manufacturer", "type", "caliber"), True),
+    ("session", "uq_session_date", ("date",), True),
+    # Keyset pagination and date range filters on the session history,
+    # and the most recent session found by delete_most_recent_session
+    ("session", "idx_session_date_time", ("date", "time", "session_id"), False),
+    # Gun/ammo filters on the session history
+    ("session_details", "idx_details_gun_session", ("gun_id", "session_id"), False),
+    ("session_details", "idx_details_ammo_session", ("ammo_id", "session_id"), False),
+]
+
+# Created by migration 2, the details of a session: joins from session, deletes and cascades
+DETAIL_INDEXES = [
+    ("session_details", "idx_details_session", ("session_id",), False),
+]
+
+# (table, constraint name, column, referenced table, referenced column, ON DELETE) added by migration 2.
+# Deleting a session takes its details with it. A gun or ammo still in use can't be deleted,
+# cascading there would silently drop history the summary tables still count
+FOREIGN_KEYS = [
+    ("session_details", "fk_details_session", "session_id", "session", "session_id", "CASCADE"),
+    ("session_details", "fk_details_gun", "gun_id", "gun", "gun_id", "RESTRICT"),
+    ("session_details", "fk_details_ammo", "ammo_id", "ammo", "ammo_id", "RESTRICT"),
+]
+
+# Versions applied so far, see MIGRATIONS
+MIGRATIONS_TABLE = {
+    "mysql": """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+    "sqlite": """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+}
+
+def _create_tables(backend, cursor, tables):
+    existing = backend.existing_tables(cursor)
+    created = []
+    for name, statement in tables.items():
+        if name not in existing:
+            cursor.execute(statement)
+            created.append(name)
+    return created
+
+def _create_indexes(backend, cursor, indexes):
+    existing = backend.existing_indexes(cursor)
+    for table, name, columns, unique in indexes:
+        if name not in existing:
+            cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON {table} ({', '.join(columns)})")
+
+# (table, key column, lookup columns, summed columns) of the rows migration 1 merges before adding
+# their unique keys. Sessions on the same day become one that lasted as long as all of them
+DUPLICATE_KEYS = [
+    ("gun", "gun_id", ("manufacturer", "model", "caliber"), ()),
+    ("ammo", "ammo_id", ("manufacturer", "type", "caliber"), ()),
+    ("session", "session_id", ("date",), ("duration_minutes",)),
+]
+
+def _merge_duplicates(cursor, table, key, columns, summed):
+    # A database from before the unique keys can hold the same gun, ammo or day more than once. The lowest
+    # id is kept and the details of the others move to it; GROUP BY and = follow the column collation,
+    # so rows that only differ in case are merged as the key would see them
+    grouped = ", ".join(columns)
+    on = " AND ".join(f"t.{column} = k.{column}" for column in columns)
+    cursor.execute(f"""
+        SELECT t.{key}, k.keep
+        FROM {table} t
+        JOIN (SELECT {grouped}, MIN({key}) AS keep FROM {table} GROUP BY {grouped} HAVING COUNT(*) > 1) k ON {on}
+        WHERE t.{key} <> k.keep
+    """)
+    merged = cursor.fetchall()
+    for duplicate, keep in merged:
+        for column in summed:
+            cursor.execute(f"SELECT COALESCE({column}, 0) FROM {table} WHERE {key} = %s", (duplicate,))
+            value = cursor.fetchone()[0]
+            cursor.execute(f"UPDATE {table} SET {column} = COALESCE({column}, 0) + %s WHERE {key} = %s", (value, keep))
+        cursor.execute(f"UPDATE session_details SET {key} = %s WHERE {key} = %s", (keep, duplicate))
+        cursor.execute(f"DELETE FROM {table} WHERE {key} = %s", (duplicate,))
+    return merged
+
+def _foreign_key(name, column, referenced_table, referenced_column, on_delete):
+    return f"CONSTRAINT {name} FOREIGN KEY ({column}) REFERENCES {referenced_table} ({referenced_column}) ON DELETE {on_delete}"
+
+def _missing_foreign_keys(existing):
+    # NO ACTION and RESTRICT both refuse the delete
+    restrict = {"NO ACTION", "RESTRICT"}
+    missing = []
+    for key in FOREIGN_KEYS:
+        rule = existing.get((key[0], key[2]), (None, None))[1]
+        if rule != key[5] and not {rule, key[5]} <= restrict:
+            missing.append(key)
+    return missing
+
+def _rebuild_sqlite_details(conn, cursor):
+    # SQLite can't change the constraints of a table, the rows are copied into a new one instead
+    columns = "detail_id, session_id, gun_id, ammo_id, rounds_fired, ammo_cost_total"
+    keys = ",\n".join(_foreign_key(*key[1:]) for key in FOREIGN_KEYS)
+    cursor.execute("PRAGMA foreign_keys = OFF")
+    try:
+        cursor.execute("BEGIN")
+        cursor.execute(f"""
+            CREATE TABLE session_details_new (
+                detail_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id INTEGER NOT NULL,
+                gun_id INTEGER NOT NULL,
+                ammo_id INTEGER NOT NULL,
+                rounds_fired INTEGER NOT NULL,
+                ammo_cost_total REAL NOT NULL,
+                {keys}
+            )
+        """)
+        cursor.execute(f"INSERT INTO session_details_new ({columns}) SELECT {columns} FROM session_details")
+        cursor.execute("DROP TABLE session_details")
+        cursor.execute("ALTER TABLE session_details_new RENAME TO session_details")
+        cursor.execute("PRAGMA foreign_key_check(session_details)")
+        orphans = cursor.fetchall()
+        if orphans:
+            raise ValueError(f"{len(orphans)} session_details rows reference a missing session, gun or ammo")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.execute("PRAGMA foreign_keys = ON")
+
+def _migration_1(backend, conn):
+    cursor = conn.cursor()
+    created = _create_tables(backend, cursor, TABLES[backend.name])
+    merged = [row for table, key, *columns in DUPLICATE_KEYS for row in _merge_duplicates(cursor, table, key, *columns)]
+    conn.commit()
+    _create_indexes(backend, cursor, INDEXES)
+    # The summaries still count the merged rows under their old ids, unless they were just created
+    if merged and not set(created) & set(SUMMARY_TABLES):
+        rebuild_summary(conn, backend)
+    return created
+
+def _migration_2(backend, conn):
+    cursor = conn.cursor()
+    existing = backend.existing_foreign_keys(cursor)
+    missing = _missing_foreign_keys(existing)
+    if backend.name == "sqlite":
+        if missing:
+            _rebuild_sqlite_details(conn, cursor)
+        # The rebuild drops the indexes of the old table
+        _create_indexes(backend, cursor, INDEXES + DETAIL_INDEXES)
+        return []
+    # Created first, the foreign key would otherwise add an index of its own
+    _create_indexes(backend, cursor, DETAIL_INDEXES)
+    for table, name, column, referenced_table, referenced_column, on_delete in missing:
+        if (table, column) in existing:
+            cursor.execute(f"ALTER TABLE {table} DROP FOREIGN KEY {existing[(table, column)][0]}")
+        # Fails when existing rows reference a missing row, those have to be cleaned up first
+        cursor.execute(f"ALTER TABLE {table} ADD {_foreign_key(name, column, referenced_table, referenced_column, on_delete)}")
+    return []
+
+# (version, description, function) applied in order and recorded in schema_migrations. The function
+# takes (backend, conn) and returns the names of the tables it created. Released migrations are never
+# edited, a schema change is a new migration; each one can be re-run safely if it fails half way.
+MIGRATIONS = [
+    (1, "Base, summary and submission tables with the lookup indexes", _migration_1),
+    (2, "Foreign keys on session_details cascading session deletes, index on session_details (session_id)", _migration_2),
+]
+
+def _applied_versions(backend, cursor):
+    if "schema_migrations" not in backend.existing_tables(cursor):
+        return {}
+    cursor.execute("SELECT version, applied_at FROM schema_migrations")
+    return dict(cursor.fetchall())
+
+def migrate(backend=None):
+    """
+    Apply the pending migrations in order, backfilling new summary tables from history.
+    Returns the (version, description) of the migrations that were applied.
+    """
+    backend = backend or get_backend()
+    applied, created = [], []
+    conn = backend.connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(MIGRATIONS_TABLE[backend.name])
+        done = _applied_versions(backend, cursor)
+        for version, description, apply in MIGRATIONS:
+            if version in done:
+                continue
+            created += apply(backend, conn)
+            # Another process may have applied it at the same time, every step is idempotent
+            cursor.execute(
+                f"INSERT INTO schema_migrations (version, description) VALUES (%s, %s) {backend.ignore_duplicates('version')}",
+                (version, description)
+            )
+            conn.commit()
+            applied.append((version, description))
+        if set(created) & set(SUMMARY_TABLES):
+            rebuild_summary(conn, backend)
+    finally:
+        backend.release(conn)
+    return applied
+
+def migration_status(backend=None):
+    """
+    (version, description, applied_at) of every migration, applied_at is None while it is pending.
+    """
+    backend = backend or get_backend()
+    conn = backend.connect()
+    try:
+        done = _applied_versions(backend, conn.cursor())
+    finally:
+        backend.release(conn)
+    return [(version, description, done.get(version)) for version, description, _ in MIGRATIONS]
+
+def check_queries():
+    """
+    (helper, query, params) for the queries the helpers in functions/db.py run, with representative arguments.
+    Every query comes from the build_* function its helper runs, so the check follows changes to them.
+    On MySQL insert_or_get finds an existing row through the unique key of its INSERT, the key lookup
+    query checks the same index.
+    """
+    end = datetime.date.today()
+    start = end - datetime.timedelta(days=90)
+    after = (end, datetime.time(12), 1)
+    history = db.ALL_DATA_COLUMNS
+    return [
+        ("insert_or_get_gun", *db.build_key_lookup_query("gun", dict(manufacturer="Glock", model="19", caliber="9mm"))),
+        ("insert_or_get_ammo", *db.build_key_lookup_query("ammo", dict(manufacturer="Federal", type="FMJ", caliber="9mm"))),
+        ("submit_session", *db.build_key_lookup_query("session", dict(date=end))),
+        ("apply_submissions", *db.build_applied_submission_query("0" * 32)),
+        ("delete_most_recent_session", *db.build_latest_session_query()),
+        ("delete_most_recent_session", *db.build_session_details_query(1)),
+        ("delete_most_recent_session", *db.build_delete_details_query(1)),
+        ("_update_summary", *db.build_session_summary_query(1)),
+        ("_update_summary", *db.build_ammo_calibers_query([1, 2])),
+        ("fetch_existing_guns", *db.build_existing_guns_query()),
+        ("fetch_existing_ammo", *db.build_existing_ammo_query()),
+        ("fetch_all_data", *db._session_history_query(history, limit=25)),
+        ("fetch_all_data next page", *db._session_history_query(history, after=after, limit=25)),
+        ("fetch_all_data by date", *db._session_history_query(history, start, end, limit=25)),
+        ("fetch_all_data by gun", *db._session_history_query(history, gun_id=1, limit=25)),
+        ("fetch_all_data by ammo", *db._session_history_query(history, ammo_id=1, limit=25)),
+        ("aggregate", *db.build_aggregate_query("gun_name", "rounds_fired")),
+        ("aggregate by date", *db.build_aggregate_query("ammo_caliber", "rounds_fired", start, end)),
+        ("fetch_metrics", *db.build_metrics_query()),
+        ("fetch_metrics by date", *db.build_metrics_query(start, end)),
+        ("fetch_most_recent_gun", *db.build_most_recent_gun_query()),
+        ("fetch_most_recent_gun by date", *db.build_most_recent_gun_query(start, end)),
+        ("fetch_trend", *db.build_trend_query("week", start, end)),
+        ("fetch_trend_breakdown by gun", *db.build_trend_breakdown_query("month", "gun", "rounds_fired", start, end)),
+        ("fetch_trend_breakdown by caliber", *db.build_trend_breakdown_query("month", "caliber", "rounds_fired", start, end)),
+        ("refresh_snapshot", *db.build_details_after_totals_query(1)),
+        ("iter_detail_frames_after", *db.build_details_after_query(1)),
+    ]
+
+# Full scans and sorts that are the point of the query: the catalog reads every gun and ammo, the
+# all-time aggregates read the summary tables with one row per gun or ammo, the breakdown by gun
+# looks up the rollups of each gun, and the aggregates and trends sort their grouped results.
+# The history pages sort the details of the 25 sessions the inner LIMIT picked, in index order.
+_PAGE_SORT = {"(sort)"}
+EXPECTED_SCANS = {
+    "fetch_existing_guns": {"gun"},
+    "fetch_existing_ammo": {"ammo"},
+    "fetch_all_data": _PAGE_SORT,
+    "fetch_all_data next page": _PAGE_SORT,
+    "fetch_all_data by date": _PAGE_SORT,
+    "fetch_all_data by gun": _PAGE_SORT,
+    "fetch_all_data by ammo": _PAGE_SORT,
+    "aggregate": {"stats", "(sort)"},
+    "aggregate by date": {"(sort)"},
+    "fetch_trend": {"(sort)"},
+    "fetch_trend_breakdown by gun": {"g"},
+    "fetch_trend_breakdown by caliber": {"(sort)"},
+}
+
+def check(backend=None):
+    """
+    EXPLAIN every query in check_queries(). Returns (helper, table, access, flagged) plan rows,
+    flagged for a full table or index scan, or a sort, not listed in EXPECTED_SCANS.
+    MySQL picks its plans from table statistics, run it against a database with realistic data.
+    """
+    backend = backend or get_backend()
+    rows = []
+    conn = backend.connect()
+    try:
+        cursor = conn.cursor()
+        for name, query, params in check_queries():
+            for table, access, full_scan in backend.explain(cursor, query, params):
+                rows.append((name, table, access, full_scan and table not in EXPECTED_SCANS.get(name, ())))
+    finally:
+        backend.release(conn)
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply the pending schema migrations, list them, or check the query plans of the db helpers.")
+    parser.add_argument("command", nargs="?", choices=["migrate", "status", "check"], default="migrate")
+    args = parser.parse_args()
+    if args.command == "migrate":
+        applied = migrate()
+        for version, description in applied:
+            print(f"Applied {version}: {description}")
+        if not applied:
+            print("Schema is up to date.")
+    elif args.command == "status":
+        for version, description, applied_at in migration_status():
+            print(f"{version:>3}  {'applied ' + str(applied_at) if applied_at else 'pending':<28}  {description}")
+    else:
+        rows = check()
+        for name, table, access, flagged in rows:
+            if table:
+                label = ("SORT" if table == "(sort)" else "FULL SCAN") if flagged else "ok"
+                print(f"{label:<9}  {name}: {access}")
+        flagged = {name for name, _, _, flagged in rows if flagged}
+        print(f"Full scans or sorts in: {', '.join(sorted(flagged))}" if flagged else "No unexpected full scans or sorts.")
+        sys.exit(1 if flagged else 0)
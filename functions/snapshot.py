@@ -0,0 +1,191 @@
+import json
+import os
+import sys
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import streamlit as st
+
+if __name__ == "__main__":
+    # Allow `python functions/snapshot.py`; appended so the pages in the repo root don't shadow stdlib modules
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from functions.config import get_setting
+from functions.db import SESSION_DTYPES, build_details_after_totals_query, connection, data_version, fetch_data, iter_detail_frames_after
+from functions.instrument import instrumented
+
+# Local columnar copy of the joined session dataset (see ALL_DATA_COLUMNS in functions/db.py), stored as
+# sealed Parquet parts of SNAPSHOT_PART_ROWS rows plus one tail part that is rewritten as details are added
+SNAPSHOT_DIR = get_setting("SNAPSHOT_DIR", "snapshot")
+PART_ROWS = int(get_setting("SNAPSHOT_PART_ROWS", 100_000))
+# Bump when SCHEMA or the manifest changes, older snapshots are then rebuilt
+FORMAT = 2
+
+STRING = pa.dictionary(pa.int32(), pa.string())
+SCHEMA = pa.schema([
+    ("session_id", pa.int32()),
+    ("date", pa.date32()),
+    ("time", pa.duration("s")),
+    ("duration_minutes", pa.int16()),
+    ("rounds_fired", pa.int32()),
+    ("ammo_cost_total", pa.float64()),
+    ("cost_per_round", pa.float64()),
+    ("gun_name", STRING),
+    ("gun_manufacturer", STRING),
+    ("ammo_type", STRING),
+    ("ammo_caliber", STRING),
+    ("ammo_manufacturer", STRING),
+])
+
+_lock = threading.Lock()
+
+def _path(directory, name):
+    return os.path.join(directory, name)
+
+# watermark is the highest session_details.detail_id in the snapshot, rows and rounds_fired its totals
+def _empty_manifest():
+    return dict(format=FORMAT, watermark=0, rows=0, rounds_fired=0, parts=[], tail=None, generation=0)
+
+def _read_manifest(directory):
+    try:
+        with open(_path(directory, "manifest.json")) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return _empty_manifest()
+    return manifest if manifest.get("format") == FORMAT else _empty_manifest()
+
+def _write_manifest(directory, manifest):
+    # Replaced atomically, readers see either the old or the new set of parts
+    temp = _path(directory, "manifest.json.tmp")
+    with open(temp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(temp, _path(directory, "manifest.json"))
+
+def _write_part(directory, name, table):
+    temp = _path(directory, name + ".tmp")
+    pq.write_table(table, temp)
+    os.replace(temp, _path(directory, name))
+
+def _read_parts(directory, names):
+    tables = [pq.read_table(_path(directory, name), memory_map=True) for name in names]
+    return pa.concat_tables(tables) if tables else SCHEMA.empty_table()
+
+def _append(directory, manifest, frames):
+    """
+    Append typed DataFrame chunks with a detail_id column to the tail part, sealing full parts as they fill up.
+    Returns the new manifest; parts no longer listed in it are left for _remove_unlisted().
+    """
+    manifest = dict(manifest, parts=list(manifest["parts"]))
+    tail = _read_parts(directory, [manifest["tail"]] if manifest["tail"] else [])
+    appended = False
+    for frame in frames:
+        if frame.empty:
+            continue
+        manifest["rows"] += len(frame)
+        manifest["rounds_fired"] += int(frame["rounds_fired"].sum())
+        manifest["watermark"] = max(manifest["watermark"], int(frame["detail_id"].max()))
+        table = pa.Table.from_pandas(frame.drop(columns="detail_id"), schema=SCHEMA, preserve_index=False).replace_schema_metadata(None)
+        tail = pa.concat_tables([tail, table])
+        appended = True
+        while tail.num_rows >= PART_ROWS:
+            manifest["generation"] += 1
+            name = f"part-{manifest['generation']:06d}.parquet"
+            _write_part(directory, name, tail.slice(0, PART_ROWS).unify_dictionaries())
+            manifest["parts"].append(name)
+            tail = tail.slice(PART_ROWS)
+    if appended:
+        manifest["generation"] += 1
+        manifest["tail"] = None
+        if tail.num_rows:
+            manifest["tail"] = f"tail-{manifest['generation']:06d}.parquet"
+            _write_part(directory, manifest["tail"], tail.unify_dictionaries())
+    return manifest
+
+def _remove_unlisted(directory, manifest):
+    listed = set(manifest["parts"]) | {manifest["tail"], "manifest.json"}
+    for name in os.listdir(directory):
+        if name not in listed:
+            try:
+                os.remove(_path(directory, name))
+            except OSError:
+                pass
+
+@instrumented
+def refresh_snapshot(directory=None):
+    """
+    Bring the snapshot up to date, fetching only the details after its detail_id watermark.
+    detail_id only grows, so every detail added since is past the watermark, including those added to
+    a session the snapshot already holds. Its rows plus the new ones then add up to log_totals unless
+    rows it holds were deleted (or changed outside of the app), in which case it is rebuilt from scratch.
+    Returns the manifest, with "rebuilt" set when the snapshot was rebuilt.
+    """
+    directory = directory or SNAPSHOT_DIR
+    with _lock:
+        os.makedirs(directory, exist_ok=True)
+        manifest = _read_manifest(directory)
+        # One connection, so on MySQL the counts and the rows come from the same consistent read
+        with connection(read=True) as conn:
+            totals = fetch_data("SELECT detail_count, rounds_fired FROM log_totals WHERE id = 1", conn=conn)
+            totals = totals[0] if totals else dict(detail_count=0, rounds_fired=0)
+            new = fetch_data(*build_details_after_totals_query(manifest["watermark"]), conn=conn)[0]
+            # The row count catches deletes, the rounds checksum rows changed in place
+            rebuilt = (
+                manifest["rows"] + int(new["new_rows"]) != int(totals["detail_count"])
+                or manifest["rounds_fired"] + int(new["new_rounds"]) != int(totals["rounds_fired"])
+            )
+            if rebuilt:
+                manifest = dict(_empty_manifest(), generation=manifest["generation"])
+            manifest = _append(directory, manifest, iter_detail_frames_after(manifest["watermark"], conn=conn))
+        _write_manifest(directory, manifest)
+        _remove_unlisted(directory, manifest)
+    return dict(manifest, rebuilt=rebuilt)
+
+def read_snapshot(directory=None):
+    """
+    Read the snapshot as a DataFrame with the SESSION_DTYPES dtypes, in the order the details were added, without refreshing it.
+    """
+    directory = directory or SNAPSHOT_DIR
+    with _lock:
+        manifest = _read_manifest(directory)
+        names = manifest["parts"] + ([manifest["tail"]] if manifest["tail"] else [])
+        table = _read_parts(directory, names)
+    df = table.unify_dictionaries().to_pandas(date_as_object=False)
+    return df.astype(SESSION_DTYPES)
+
+# Shared by every session until the app writes again or the TTL expires, callers must not modify the frame
+@st.cache_resource(ttl=float(get_setting("DB_CACHE_TTL", 600)), max_entries=1, show_spinner=False)
+def _load_snapshot(version):
+    refresh_snapshot()
+    return read_snapshot()
+
+def session_frame(start_date=None, end_date=None):
+    """
+    The joined session dataset as a typed DataFrame, in the order the details were added, read from the
+    local snapshot after fetching any details added since it was last refreshed.
+    """
+    df = _load_snapshot(data_version())
+    mask = None
+    if start_date is not None:
+        mask = df["date"] >= pd.Timestamp(start_date)
+    if end_date is not None:
+        end_mask = df["date"] <= pd.Timestamp(end_date)
+        mask = end_mask if mask is None else mask & end_mask
+    return df.copy() if mask is None else df[mask]
+
+@instrumented
+def export_snapshot_csv(fileobj, start_date=None, end_date=None):
+    """
+    Write the joined session dataset to fileobj as CSV, newest first like export_all_data_csv,
+    from the local snapshot. Returns the number of rows written.
+    """
+    df = session_frame(start_date, end_date)
+    df = df.sort_values(["date", "time", "session_id"], ascending=False, kind="stable")
+    df = df.assign(time=(pd.Timestamp(0) + df["time"]).dt.strftime("%H:%M:%S"))
+    df.to_csv(fileobj, index=False)
+    return len(df)
+
+if __name__ == "__main__":
+    manifest = refresh_snapshot()
+    print(f"{'Rebuilt' if manifest['rebuilt'] else 'Refreshed'} snapshot: {manifest['rows']} rows in {len(manifest['parts']) + bool(manifest['tail'])} parts, watermark detail_id {manifest['watermark']}")
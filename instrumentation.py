@@ -0,0 +1,36 @@
+import streamlit as st
+import pandas as pd
+from functions.db import coalesce_stats, pool_stats
+from functions.instrument import summary, reset, SLOW_QUERY_MS, SLOW_QUERY_LOG
+
+st.title("Instrumentation")
+st.caption(
+    f"Timings recorded by this app process since it started or was last reset, slowest total first. "
+    f"Queries slower than {SLOW_QUERY_MS:g} ms are also written to {SLOW_QUERY_LOG or 'no log (SLOW_QUERY_LOG is empty)'}."
+)
+
+if st.button("Reset Timings"):
+    reset()
+    st.rerun()
+
+# One table per kind of sample, see functions/instrument.py
+for title, kind in [
+    ("Pages", "page"),
+    ("Page Sections", "section"),
+    ("DB Helpers (cache misses)", "helper"),
+    ("Queries", "query"),
+    ("Coalesced Reads (time spent waiting on an identical query)", "coalesced"),
+    ("Connection Checkouts", "connect"),
+]:
+    st.subheader(title)
+    rows = summary(kind)
+    if rows:
+        st.dataframe(pd.DataFrame(rows).round(2), use_container_width=True, hide_index=True)
+    else:
+        st.caption("Nothing recorded yet.")
+
+st.subheader("Connection Pool")
+st.json(pool_stats())
+
+st.subheader("Read Coalescing")
+st.json(coalesce_stats())
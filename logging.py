@@ -1,53 +1,51 @@
 import streamlit as st
 import datetime
-import pandas as pd
 from functions.db import (
-    get_connection,
     verify_password,
-    insert_or_get_gun,
-    insert_or_get_ammo,
-    insert_session_and_details,
     delete_most_recent_session,
-    fetch_existing_guns,
-    fetch_existing_ammo,
     fetch_recent_sessions,
 )
+from functions.outbox import discard_failed, enqueue_session, ensure_flusher, failed_entries, retry_failed, status as outbox_status, submission_states
+from functions.catalog import get_catalog
+from functions.dash import display_paged_table, prefetch_page
+from functions.bulk_import import REQUIRED_COLUMNS, OPTIONAL_COLUMNS, import_sessions, format_report
 
 # Streamlit Form
 st.title("Shooting Log")
 
-# Filter for existing guns and ammo first, if not present, add new gun and ammo
-existing_guns_df = pd.DataFrame(fetch_existing_guns())
-existing_guns_df = existing_guns_df.sort_values(by='manufacturer')
-existing_guns_df['display'] = existing_guns_df.apply(
-    lambda row: f"{row['name']} - {row['ownership_type']} ({row['caliber']})", axis=1
+# Submissions go to the local outbox and are written to the database in the background
+ensure_flusher()
+
+# Recent sessions are only shown at the bottom, start loading them while the catalog loads and
+# the form renders; the filters are the widget values from the previous run
+def recent_session_filters(history_range, gun_id, ammo_id):
+    return dict(
+        start_date=history_range[0] if len(history_range) > 0 else None,
+        end_date=history_range[1] if len(history_range) > 1 else None,
+        gun_id=gun_id,
+        ammo_id=ammo_id,
+    )
+
+recent_sessions = prefetch_page("recent_sessions", fetch_recent_sessions, recent_session_filters(
+    st.session_state.get("history_range", ()),
+    st.session_state.get("history_gun"),
+    st.session_state.get("history_ammo"),
+))
+
+# Existing guns and ammo, the selectboxes hold ids and None stands for adding a new one
+catalog = get_catalog()
+
+selected_gun_id = st.selectbox(
+    "Select Gun", catalog.gun_ids() + [None],
+    format_func=lambda gun_id: "Add New Gun" if gun_id is None else catalog.gun_label(gun_id)
 )
-existing_guns = existing_guns_df['display'].tolist() + ["Add New Gun"]
-
-selected_gun_display = st.selectbox("Select Gun", existing_guns)
-
-if selected_gun_display == "Add New Gun":
-    selected_gun = "Add New Gun"
-else:
-    selected_gun = existing_guns_df.loc[existing_guns_df['display'] == selected_gun_display, 'name'].values[0]
-
-existing_ammo_df = pd.DataFrame(fetch_existing_ammo())
-existing_ammo_df = existing_ammo_df.sort_values(by='manufacturer')
-if selected_gun != "Add New Gun":
-    existing_ammo_df = existing_ammo_df[
-        existing_ammo_df['caliber'] == existing_guns_df.loc[existing_guns_df['name'] == selected_gun, 'caliber'].values[0]
-    ]
-existing_ammo_df['display'] = existing_ammo_df.apply(
-    lambda row: f"{row['manufacturer']} - {row['type']} ({row['caliber']})", axis=1
-)
-existing_ammo = existing_ammo_df['display'].tolist() + ["Add New Ammo"]
-
-selected_ammo_display = st.selectbox("Select Ammo", existing_ammo)
 
-if selected_ammo_display == "Add New Ammo":
-    selected_ammo = "Add New Ammo"
-else:
-    selected_ammo = existing_ammo_df.loc[existing_ammo_df['display'] == selected_ammo_display, 'manufacturer'].values[0]
+# Only offer ammo matching the caliber of the selected gun
+ammo_caliber_filter = None if selected_gun_id is None else catalog.guns[selected_gun_id]['caliber']
+selected_ammo_id = st.selectbox(
+    "Select Ammo", catalog.ammo_ids(ammo_caliber_filter) + [None],
+    format_func=lambda ammo_id: "Add New Ammo" if ammo_id is None else catalog.ammo_label(ammo_id)
+)
 
 with st.form("unified_form"):
     # Session Details
@@ -58,8 +56,8 @@ with st.form("unified_form"):
     target_type = st.selectbox("Target Type", ["Steel", "Paper"]).lower()
     duration_minutes = st.number_input("Duration (Minutes)", min_value=1)
 
-    # Gun Details
-    if selected_gun == "Add New Gun":
+    # Gun Details, an existing gun is passed on by id
+    if selected_gun_id is None:
         st.subheader("Gun Details")
         category = st.selectbox("Category", ["Pistol", "Rifle", "Shotgun", "Revolver"]).lower()
         manufacturer = st.text_input("Manufacturer")
@@ -67,30 +65,20 @@ with st.form("unified_form"):
         caliber = st.selectbox("Caliber", ["9mm", ".22 LR", ".45 ACP", ".38 Special", ".223 Rem", ".308 Win", "12 Gauge"]).lower()
         ownership_type = st.selectbox("Ownership Type", ["Personal", "Rental"]).lower()
         gun_notes = st.text_area("Notes (optional)")
-        name = f"{manufacturer} {model}"
+        gun = dict(category=category, manufacturer=manufacturer, model=model, caliber=caliber, ownership_type=ownership_type, gun_notes=gun_notes)
     else:
-        selected_gun_id = existing_guns_df.loc[existing_guns_df['name'] == selected_gun, 'gun_id'].values[0]
-        category = existing_guns_df.loc[existing_guns_df['name'] == selected_gun, 'category'].values[0]
-        manufacturer = existing_guns_df.loc[existing_guns_df['name'] == selected_gun, 'manufacturer'].values[0]
-        model = existing_guns_df.loc[existing_guns_df['name'] == selected_gun, 'model'].values[0]
-        caliber = existing_guns_df.loc[existing_guns_df['name'] == selected_gun, 'caliber'].values[0]
-        ownership_type = existing_guns_df.loc[existing_guns_df['name'] == selected_gun, 'ownership_type'].values[0]
-        gun_notes = existing_guns_df.loc[existing_guns_df['name'] == selected_gun, 'gun_notes'].values[0]
-        name = selected_gun
-
-    # Ammo Details
-    if selected_ammo == "Add New Ammo":
+        gun = selected_gun_id
+
+    # Ammo Details, an existing ammo is passed on by id
+    if selected_ammo_id is None:
         st.subheader("Ammo Details")
         ammo_manufacturer = st.text_input("Ammo Manufacturer")
         ammo_type = st.text_input("Ammo Type (e.g., FMJ, HP)")
         ammo_caliber = st.selectbox("Caliber", ["9mm", ".22 LR", ".45 ACP", ".38 Special", ".223 Rem", ".308 Win", "12 Gauge"]).lower()
         ammo_notes = st.text_area("Ammo Notes (optional)")
+        ammo = dict(manufacturer=ammo_manufacturer, ammo_type=ammo_type, caliber=ammo_caliber, ammo_notes=ammo_notes)
     else:
-        selected_ammo_id = existing_ammo_df.loc[existing_ammo_df['manufacturer'] == selected_ammo, 'ammo_id'].values[0]
-        ammo_manufacturer = existing_ammo_df.loc[existing_ammo_df['manufacturer'] == selected_ammo, 'manufacturer'].values[0]
-        ammo_type = existing_ammo_df.loc[existing_ammo_df['manufacturer'] == selected_ammo, 'type'].values[0]
-        ammo_caliber = existing_ammo_df.loc[existing_ammo_df['manufacturer'] == selected_ammo, 'caliber'].values[0]
-        ammo_notes = existing_ammo_df.loc[existing_ammo_df['manufacturer'] == selected_ammo, 'ammo_notes'].values[0]
+        ammo = selected_ammo_id
 
     # Rounds Fired
     st.subheader("Session Details - Rounds Fired and Ammo Cost")
@@ -106,20 +94,73 @@ with st.form("unified_form"):
     if submitted:
         if verify_password(password):
             try:
-                gun_id = insert_or_get_gun(category, manufacturer, model, caliber, ownership_type, gun_notes)
-                ammo_id = insert_or_get_ammo(ammo_manufacturer, ammo_type, ammo_caliber, ammo_notes)
-                session_id = insert_session_and_details(date, time, target_type, duration_minutes, gun_id, ammo_id, rounds_fired, ammo_cost_total)
-                st.success(f"Session, Gun, and Ammo added successfully! Session ID: {session_id}")
+                # Queued locally, gun, ammo and session are resolved in one transaction when it is flushed
+                submission_id = enqueue_session(date, time, target_type, duration_minutes, gun, ammo, rounds_fired, ammo_cost_total)
+                st.session_state.setdefault("queued_submissions", []).append(submission_id)
+                st.success("Session saved! It will appear in Recent Sessions once written to the database.")
             except Exception as e:
                 st.error(f"Error: {e}")
         else:
             st.error("Incorrect password. Please try again.")
 
+# Failed outbox entries with the actions to queue them again or give them up
+def show_failed_submissions(count):
+    entries = {entry["submission_id"]: entry for entry in failed_entries()}
+    def label(submission_id):
+        entry = entries[submission_id]
+        return f"{entry['date']} {entry['time']} - {entry['rounds_fired']} rounds ({entry['attempts']} attempts, {entry['last_error']})"
+    with st.expander(f"{count} session(s) could not be written to the database", expanded=True):
+        selected = st.multiselect("Failed Sessions", list(entries), default=list(entries), format_func=label)
+        discard_password = st.text_input("Enter Password to Discard Sessions", type="password", key="discard_password")
+        retry_col, discard_col = st.columns(2)
+        if retry_col.button("Retry Selected", disabled=not selected):
+            retry_failed(selected)
+            st.session_state.setdefault("queued_submissions", []).extend(selected)
+            st.rerun()
+        if discard_col.button("Discard Selected", disabled=not selected):
+            if verify_password(discard_password):
+                discard_failed(selected)
+                st.rerun()
+            else:
+                st.error("Incorrect password. Please try again.")
+
+# Outbox status, polls while this session's submissions are still pending and reruns
+# the page once they are written so the history and catalog pick them up
+def show_outbox_status():
+    queued = st.session_state.get("queued_submissions", [])
+    states = submission_states(queued)
+    written = [submission_id for submission_id in queued if states.get(submission_id, ("flushed", None))[0] == "flushed"]
+    # Failed entries are listed below until retried, polling for them would never end
+    failed = [submission_id for submission_id in queued if states.get(submission_id, (None, None))[0] == "failed"]
+    if failed:
+        queued = st.session_state["queued_submissions"] = [submission_id for submission_id in queued if submission_id not in failed]
+    state = outbox_status()
+    if state["pending"]:
+        message = f"{state['pending']} session(s) waiting to be written to the database."
+        if state["last_error"]:
+            st.warning(f"{message} Retrying, last error: {state['last_error']}")
+        else:
+            st.info(message)
+    if state["failed"]:
+        show_failed_submissions(state["failed"])
+    if written:
+        st.session_state["queued_submissions"] = [submission_id for submission_id in queued if submission_id not in written]
+        st.session_state["written_sessions"] = [states[submission_id][1] for submission_id in written if submission_id in states]
+        st.rerun()
+    written_sessions = st.session_state.pop("written_sessions", None)
+    if written_sessions:
+        st.success(f"Session written to the database! Session ID: {', '.join(map(str, written_sessions))}")
+
+st.fragment(show_outbox_status, run_every=5 if st.session_state.get("queued_submissions") else None)()
+
 # Password Field for Deletion
 delete_password = st.text_input("Enter Password to Delete Most Recent Session", type="password")
 delete_button = st.button("Delete Most Recent Session")
 if delete_button:
-    if verify_password(delete_password):
+    if outbox_status()["pending"]:
+        # The most recent session may still be in the outbox; failed entries don't count, they wait for the user
+        st.warning("Sessions are still waiting to be written to the database, try again once they are.")
+    elif verify_password(delete_password):
         try:
             session_id = delete_most_recent_session()
             if session_id:
@@ -131,8 +172,46 @@ if delete_button:
     else:
         st.error("Incorrect password. Please try again.")
 
-# Display recent sessions
+# Bulk import of historical sessions from a file
+with st.expander("Bulk Import Sessions"):
+    st.caption(
+        "CSV or Excel file with one row per gun/ammo used in a session. Required columns: "
+        + ", ".join(REQUIRED_COLUMNS) + ". Optional columns: " + ", ".join(OPTIONAL_COLUMNS) + "."
+    )
+    import_file = st.file_uploader("Sessions File", type=["csv", "xlsx", "xls"])
+    import_password = st.text_input("Enter Password to Import Data", type="password")
+    import_col1, import_col2 = st.columns(2)
+    validate_button = import_col1.button("Validate (Dry Run)")
+    import_button = import_col2.button("Import Sessions")
+    if import_file is not None and (validate_button or import_button):
+        if import_button and not verify_password(import_password):
+            st.error("Incorrect password. Please try again.")
+        else:
+            try:
+                report = import_sessions(import_file, filename=import_file.name, dry_run=not import_button)
+                if report["errors"]:
+                    st.error("The file has invalid rows, nothing was imported.")
+                elif report["imported"]:
+                    st.success("Sessions imported successfully!")
+                else:
+                    st.info("The file is valid and ready to import.")
+                st.code(format_report(report), language=None)
+            except Exception as e:
+                st.error(f"Error: {e}")
+
+# Display recent sessions, newest first, one page at a time
 st.header("Recent Sessions")
-recent_sessions = fetch_recent_sessions()
-df = pd.DataFrame(recent_sessions)
-st.write(df)
\ No newline at end of file
+filter_col1, filter_col2, filter_col3 = st.columns(3)
+history_range = filter_col1.date_input("Date Range", value=(), key="history_range")
+history_gun_id = filter_col2.selectbox(
+    "Gun", [None] + catalog.gun_ids(),
+    format_func=lambda gun_id: "All Guns" if gun_id is None else catalog.gun_label(gun_id),
+    key="history_gun"
+)
+history_ammo_id = filter_col3.selectbox(
+    "Ammo", [None] + catalog.ammo_ids(),
+    format_func=lambda ammo_id: "All Ammo" if ammo_id is None else catalog.ammo_label(ammo_id),
+    key="history_ammo"
+)
+history_filters = recent_session_filters(history_range, history_gun_id, history_ammo_id)
+display_paged_table("recent_sessions", fetch_recent_sessions, history_filters, prefetched=recent_sessions)
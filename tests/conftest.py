@@ -0,0 +1,35 @@
+import os
+import sys
+
+# Appended so the pages in the repo root don't shadow stdlib modules, as in functions/benchmark.py
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Silence the bare-mode warnings streamlit logs outside of `streamlit run`
+from streamlit import config as streamlit_config, logger as streamlit_logger
+streamlit_config.get_option("logger.level")
+streamlit_logger.set_log_level("error")
+
+import pytest
+
+from functions import db
+from functions.backends import SQLiteBackend
+
+@pytest.fixture
+def sqlite_backend(tmp_path):
+    """
+    A migrated SQLiteBackend on a temporary file, installed as the global backend.
+    """
+    backend = SQLiteBackend(str(tmp_path / "test.sqlite3"))
+    db.set_backend(backend)
+    yield backend
+    db._backend, db._replicas = None, None
+    db.invalidate_cache()
+
+@pytest.fixture
+def reset_backend():
+    """
+    Uninstall whatever global backend the test installed.
+    """
+    yield
+    db._backend, db._replicas = None, None
+    db.invalidate_cache()
@@ -0,0 +1,155 @@
+import threading
+import time
+
+import pytest
+
+from functions import db, schema
+from functions.backends import SQLiteBackend
+
+def _run_with_timeout(func, timeout=30):
+    # A deadlock would otherwise hang the whole test run
+    errors = []
+    def target():
+        try:
+            func()
+        except Exception as error:
+            errors.append(error)
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "opening the database did not finish"
+    if errors:
+        raise errors[0]
+
+def _create_pre_rollup_database(path):
+    # A database from before session_rollups and the versioned migrations, with history in it
+    backend = SQLiteBackend(path)
+    conn = backend.connect()
+    try:
+        cursor = conn.cursor()
+        for name in ("gun", "ammo", "session", "session_details"):
+            cursor.execute(schema.TABLES["sqlite"][name])
+        cursor.execute("INSERT INTO gun (name, category, manufacturer, model, caliber) VALUES ('Glock 19', 'Pistol', 'Glock', '19', '9mm')")
+        cursor.execute("INSERT INTO ammo (manufacturer, type, caliber) VALUES ('Federal', 'FMJ', '9mm')")
+        cursor.execute("INSERT INTO session (date, time, target_type, duration_minutes) VALUES ('2024-03-01', '10:00:00', 'Paper', 60)")
+        cursor.execute("INSERT INTO session_details (session_id, gun_id, ammo_id, rounds_fired, ammo_cost_total) VALUES (1, 1, 1, 100, 25.0)")
+        conn.commit()
+    finally:
+        backend.release(conn)
+
+@pytest.mark.parametrize("open_with", ["set_backend", "get_backend"])
+def test_opening_pre_rollup_database_migrates_it(tmp_path, monkeypatch, reset_backend, open_with):
+    path = str(tmp_path / "legacy.sqlite3")
+    _create_pre_rollup_database(path)
+    backend = SQLiteBackend(path)
+    if open_with == "set_backend":
+        _run_with_timeout(lambda: db.set_backend(backend))
+    else:
+        monkeypatch.setattr(db, "_backend", None)
+        monkeypatch.setattr(db, "backend_from_settings", lambda: backend)
+        _run_with_timeout(db.get_backend)
+
+    assert db.get_backend() is backend
+    conn = backend.connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT period, dimension, rounds_fired FROM session_rollups WHERE dim_key = '' ORDER BY period")
+        assert cursor.fetchall() == [("day", "total", 100), ("month", "total", 100), ("week", "total", 100)]
+        cursor.execute("SELECT detail_count, rounds_fired FROM log_totals WHERE id = 1")
+        assert cursor.fetchone() == (1, 100)
+    finally:
+        backend.release(conn)
+
+@pytest.mark.parametrize("measure", ["avg_rounds_fired", "cost_per_round"])
+def test_aggregate_summary_matches_history(sqlite_backend, measure):
+    gun = dict(category="Pistol", manufacturer="Glock", model="19", caliber="9mm", ownership_type="Owned", gun_notes="")
+    ammo = dict(manufacturer="Federal", ammo_type="FMJ", caliber="9mm", ammo_notes="")
+    for day, rounds_fired in ((1, 75), (2, 76)):
+        db.submit_session(f"2024-03-0{day}", "10:00:00", "Paper", 60, gun, ammo, rounds_fired, rounds_fired * 0.3)
+
+    # Without a date range the summary tables answer, with one the history does
+    all_time = db.aggregate("gun_name", measure)
+    ranged = db.aggregate("gun_name", measure, "2024-01-01", "2024-12-31")
+    assert all_time[0][measure] == pytest.approx(ranged[0][measure])
+    if measure == "avg_rounds_fired":
+        assert all_time[0][measure] == pytest.approx(75.5)
+
+def _wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+def _run_concurrently(func, followers, monkeypatch):
+    """
+    Call db.fetch_data from a leader and then from followers while the leader's read is blocked in func.
+    Returns ({thread index: result or exception}, number of executed reads).
+    """
+    release, calls = threading.Event(), []
+    def fetch(query, params=None, conn=None):
+        calls.append(query)
+        release.wait(10)
+        return func()
+    monkeypatch.setattr(db, "_fetch", fetch)
+    outcomes = {}
+    def call(index):
+        try:
+            outcomes[index] = db.fetch_data("SELECT 1 WHERE 1 = %s", [1])
+        except Exception as error:
+            outcomes[index] = error
+
+    before = db.coalesce_stats()
+    threads = [threading.Thread(target=call, args=(0,))]
+    threads[0].start()
+    _wait_for(lambda: calls)
+    threads += [threading.Thread(target=call, args=(index,)) for index in range(1, followers + 1)]
+    for thread in threads[1:]:
+        thread.start()
+    _wait_for(lambda: db.coalesce_stats()["coalesced"] - before["coalesced"] == followers)
+    release.set()
+    for thread in threads:
+        thread.join(10)
+    return outcomes, len(calls)
+
+def test_concurrent_reads_share_one_fetch(monkeypatch):
+    outcomes, executed = _run_concurrently(lambda: [{"value": 1}], 8, monkeypatch)
+    assert executed == 1
+    assert all(rows == [{"value": 1}] for rows in outcomes.values()) and len(outcomes) == 9
+    # Every caller can change its rows without affecting the others
+    assert len({id(rows[0]) for rows in outcomes.values()}) == 9
+    assert db.coalesce_stats()["in_flight"] == 0
+
+def test_failed_read_raises_in_every_waiter(monkeypatch):
+    def fail():
+        raise RuntimeError("connection lost")
+    outcomes, executed = _run_concurrently(fail, 4, monkeypatch)
+    assert executed == 1
+    assert len(outcomes) == 5 and all(isinstance(error, RuntimeError) for error in outcomes.values())
+    # Nothing is left behind, the next read runs again
+    monkeypatch.setattr(db, "_fetch", lambda query, params=None, conn=None: [{"value": 2}])
+    assert db.fetch_data("SELECT 1 WHERE 1 = %s", [1]) == [{"value": 2}]
+
+def _import_row(**overrides):
+    row = dict(
+        date="2024-03-01", time="10:00:00", target_type="Paper", duration_minutes=60,
+        gun_category="Pistol", gun_manufacturer="Glock", gun_model="19", gun_caliber="9mm", ownership_type="Owned", gun_notes="",
+        ammo_manufacturer="Federal", ammo_type="FMJ", ammo_caliber="9mm", ammo_notes="", rounds_fired=50, ammo_cost_total=12.5,
+    )
+    return dict(row, **overrides)
+
+def test_bulk_insert_resolves_names_to_existing_rows(sqlite_backend):
+    gun_id = db.insert_or_get_gun("Pistol", "Glock", "19", "9mm", "Owned", "")
+    ammo_id = db.insert_or_get_ammo("Federal", "FMJ", "9mm", "")
+    rows = [
+        _import_row(gun_manufacturer="GLOCK", ammo_type="fmj"),
+        _import_row(date="2024-03-02", gun_model="17", rounds_fired=80),
+    ]
+    assert db.bulk_insert_sessions(rows, dry_run=True) == dict(new_guns=1, new_ammo=0, new_sessions=2, details=2)
+    assert db.bulk_insert_sessions(rows) == dict(new_guns=1, new_ammo=0, new_sessions=2, details=2)
+
+    details = db.fetch_data("SELECT gun_id, ammo_id, rounds_fired FROM session_details ORDER BY detail_id")
+    assert details[0] == dict(gun_id=gun_id, ammo_id=ammo_id, rounds_fired=50)
+    assert details[1]["gun_id"] not in (gun_id, None) and details[1]["ammo_id"] == ammo_id
+    assert db.fetch_data("SELECT gun_id, detail_count FROM gun_stats ORDER BY gun_id") == [
+        dict(gun_id=gun_id, detail_count=1), dict(gun_id=details[1]["gun_id"], detail_count=1)
+    ]
@@ -0,0 +1,76 @@
+import datetime
+import sqlite3
+
+import pytest
+
+from functions import outbox
+
+GUN = dict(category="Pistol", manufacturer="Glock", model="19", caliber="9mm", ownership_type="Owned", gun_notes="")
+AMMO = dict(manufacturer="Federal", ammo_type="FMJ", caliber="9mm", ammo_notes="")
+
+@pytest.fixture
+def path(tmp_path, sqlite_backend, monkeypatch):
+    # No backoff, so entries that failed are due again right away
+    monkeypatch.setattr(outbox, "_backoff", lambda attempts: 0)
+    return str(tmp_path / "outbox.sqlite3")
+
+def _enqueue(path, gun=GUN, rounds_fired=50):
+    return outbox.enqueue_session(datetime.date(2024, 3, 1), datetime.time(10), "Paper", 60, gun, AMMO, rounds_fired, 12.5, path=path)
+
+def test_identical_entry_is_queued_once(path):
+    first = _enqueue(path)
+    assert _enqueue(path) == first
+    assert _enqueue(path, rounds_fired=60) != first
+    assert outbox.status(path)["pending"] == 2
+
+def test_flush_applies_entries(path):
+    submission_id = _enqueue(path)
+    assert outbox.flush(path) == 1
+    state, session_id = outbox.submission_states([submission_id], path)[submission_id]
+    assert state == "flushed" and session_id is not None
+    assert outbox.status(path)["pending"] == 0
+
+def test_rejected_entry_fails_without_retrying(path):
+    # No gun 999, the foreign key rejects the details
+    submission_id = _enqueue(path, gun=999)
+    assert outbox.flush(path) == 0
+    assert outbox.submission_states([submission_id], path)[submission_id][0] == "failed"
+    [entry] = outbox.failed_entries(path)
+    assert entry["attempts"] == 1 and entry["last_error"].startswith("IntegrityError")
+
+def test_entry_fails_after_max_attempts(path, monkeypatch):
+    def unavailable(submissions):
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(outbox, "apply_submissions", unavailable)
+    monkeypatch.setattr(outbox, "MAX_ATTEMPTS", 3)
+    submission_id = _enqueue(path)
+    outbox.flush(path)
+    assert outbox.submission_states([submission_id], path)[submission_id][0] == "failed"
+    assert outbox.failed_entries(path)[0]["attempts"] == 3
+    state = outbox.status(path)
+    assert state["failed"] == 1 and state["pending"] == 0
+
+def test_failed_entries_are_not_deduplicated(path):
+    failed = _enqueue(path, gun=999)
+    outbox.flush(path)
+    assert _enqueue(path, gun=999) != failed
+
+def test_retry_and_discard_failed_entries(path, monkeypatch):
+    def unavailable(submissions):
+        raise sqlite3.OperationalError("database is locked")
+    apply_submissions = outbox.apply_submissions
+    monkeypatch.setattr(outbox, "apply_submissions", unavailable)
+    monkeypatch.setattr(outbox, "MAX_ATTEMPTS", 1)
+    retried, discarded = _enqueue(path), _enqueue(path, rounds_fired=60)
+    outbox.flush(path)
+    assert outbox.status(path)["failed"] == 2
+
+    monkeypatch.setattr(outbox, "apply_submissions", apply_submissions)
+    assert outbox.retry_failed([retried], path) == 1
+    assert outbox.discard_failed([discarded], path) == 1
+    # Only failed entries are touched
+    assert outbox.retry_failed([retried], path) == 0
+    assert outbox.flush(path) == 1
+    states = outbox.submission_states([retried, discarded], path)
+    assert list(states) == [retried] and states[retried][0] == "flushed"
+    assert outbox.status(path)["failed"] == 0
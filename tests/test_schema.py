@@ -0,0 +1,86 @@
+import pytest
+
+from functions import schema
+from functions.backends import SQLiteBackend
+
+@pytest.fixture
+def legacy(tmp_path):
+    """
+    A database from before the versioned migrations: the base tables without unique keys or foreign keys,
+    holding the same gun, ammo and session date twice.
+    """
+    backend = SQLiteBackend(str(tmp_path / "legacy.sqlite3"))
+    conn = backend.connect()
+    try:
+        cursor = conn.cursor()
+        for name in ("gun", "ammo", "session", "session_details"):
+            cursor.execute(schema.TABLES["sqlite"][name])
+        cursor.executemany(
+            "INSERT INTO gun (name, category, manufacturer, model, caliber) VALUES (%s, %s, %s, %s, %s)",
+            [("Glock 19", "Pistol", "Glock", "19", "9mm"), ("glock 19", "Pistol", "glock", "19", "9MM"), ("Ruger 10/22", "Rifle", "Ruger", "10/22", ".22")]
+        )
+        cursor.executemany(
+            "INSERT INTO ammo (manufacturer, type, caliber) VALUES (%s, %s, %s)",
+            [("Federal", "FMJ", "9mm"), ("FEDERAL", "fmj", "9mm")]
+        )
+        cursor.executemany(
+            "INSERT INTO session (date, time, target_type, duration_minutes) VALUES (%s, %s, %s, %s)",
+            [("2024-01-01", "10:00:00", "Paper", 60), ("2024-01-01", "14:00:00", "Steel", 30), ("2024-01-02", "10:00:00", "Paper", 45)]
+        )
+        cursor.executemany(
+            "INSERT INTO session_details (session_id, gun_id, ammo_id, rounds_fired, ammo_cost_total) VALUES (%s, %s, %s, %s, %s)",
+            [(1, 1, 1, 50, 10.0), (2, 2, 2, 100, 20.0), (3, 3, 1, 25, 5.0)]
+        )
+        conn.commit()
+    finally:
+        backend.release(conn)
+    return backend
+
+def _rows(backend, query):
+    conn = backend.connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query)
+        return cursor.fetchall()
+    finally:
+        backend.release(conn)
+
+def test_migrate_fresh_database(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "fresh.sqlite3"))
+    assert [version for version, _ in schema.migrate(backend)] == [1, 2]
+    assert all(applied_at for _, _, applied_at in schema.migration_status(backend))
+    assert schema.migrate(backend) == []
+
+def test_migrate_legacy_database_merges_duplicates(legacy):
+    assert [version for version, _ in schema.migrate(legacy)] == [1, 2]
+
+    # The lowest id of each duplicate is kept and the details move to it
+    assert _rows(legacy, "SELECT gun_id FROM gun ORDER BY gun_id") == [(1,), (3,)]
+    assert _rows(legacy, "SELECT ammo_id FROM ammo") == [(1,)]
+    assert _rows(legacy, "SELECT session_id, duration_minutes FROM session ORDER BY session_id") == [(1, 90), (3, 45)]
+    assert _rows(legacy, "SELECT detail_id, session_id, gun_id, ammo_id FROM session_details ORDER BY detail_id") == [
+        (1, 1, 1, 1), (2, 1, 1, 1), (3, 3, 3, 1)
+    ]
+    # The summaries are built from the merged rows
+    assert _rows(legacy, "SELECT gun_id, detail_count, rounds_fired FROM gun_stats ORDER BY gun_id") == [(1, 2, 150), (3, 1, 25)]
+    assert _rows(legacy, "SELECT session_count, session_minutes, detail_count, rounds_fired FROM log_totals") == [(2, 135, 3, 175)]
+
+    indexes = {name for name, in _rows(legacy, "SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"uq_gun_lookup", "uq_ammo_lookup", "uq_session_date", "idx_details_session"} <= indexes
+    assert schema.migrate(legacy) == []
+
+def test_migrated_legacy_database_has_foreign_keys(legacy):
+    schema.migrate(legacy)
+    conn = legacy.connect()
+    try:
+        cursor = conn.cursor()
+        # A gun in use can't be deleted, deleting a session takes its details with it
+        with pytest.raises(Exception, match="FOREIGN KEY"):
+            cursor.execute("DELETE FROM gun WHERE gun_id = 1")
+        conn.rollback()
+        cursor.execute("DELETE FROM session WHERE session_id = 1")
+        conn.commit()
+        cursor.execute("SELECT COUNT(*) FROM session_details")
+        assert cursor.fetchone() == (1,)
+    finally:
+        legacy.release(conn)